@@ -0,0 +1,210 @@
+import hashlib
+import json
+from collections import defaultdict
+from functools import wraps
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+from app.models import Answer, Question, Tag, TagFeed
+from app.pagination import CursorPaginator, InvalidCursor
+
+PAGE_SIZE = 20
+
+# Every question field a client may ask for with ?fields=, and the values() columns behind it.
+QUESTION_COLUMNS = {
+    'id': ['id'],
+    'title': ['title'],
+    'text': ['text'],
+    'date': ['date'],
+    'rating': ['rating'],
+    'answers_count': ['answers_count'],
+    'author': ['author__user_id', 'author__name'],
+    'tags': [],
+}
+FEED_FIELDS = ['id', 'title', 'date', 'rating', 'answers_count', 'author', 'tags']
+DETAIL_FIELDS = list(QUESTION_COLUMNS)
+
+ANSWER_COLUMNS = {
+    'id': ['id'],
+    'text': ['text'],
+    'date': ['date'],
+    'rating': ['rating'],
+    'is_correct': ['is_correct'],
+    'author': ['author__user_id', 'author__name'],
+}
+ANSWER_FIELDS = list(ANSWER_COLUMNS)
+
+# What a question response changes with: version is bumped on every edit, vote, answer and
+# tag change, active_at on every vote and answer; the author name is shown but not versioned.
+QUESTION_VALIDATORS = ('id', 'version', 'active_at', 'author__name')
+# Answers are not versioned and only change through votes and the admin.
+ANSWER_VALIDATORS = ('id', 'rating', 'is_correct', 'author__name')
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def api_view(view):
+    """GET/HEAD only, ApiError as a JSON error body."""
+    @require_safe
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except ApiError as e:
+            return JsonResponse({'error': str(e)}, status=e.status)
+
+    return wrapper
+
+
+def requested_fields(request, columns, default):
+    """?fields=a,b as a list starting with id, or the default fields."""
+    if not request.GET.get('fields'):
+        return default
+    fields = [field for field in request.GET['fields'].split(',') if field]
+    unknown = sorted(set(fields) - set(columns))
+    if unknown:
+        raise ApiError('unknown fields: {}'.format(', '.join(unknown)))
+    return ['id'] + [field for field in dict.fromkeys(fields) if field != 'id']
+
+
+def cursor_page(request, rows):
+    paginator = CursorPaginator(rows, PAGE_SIZE)
+    try:
+        return paginator.page(after=request.GET.get('after'), before=request.GET.get('before'))
+    except InvalidCursor:
+        raise ApiError('invalid cursor')
+
+
+def validators(rows, *extra):
+    """A strong ETag over the validator columns of the rows, and the latest active_at as Last-Modified."""
+    digest = hashlib.md5(json.dumps([extra, list(rows)], cls=DjangoJSONEncoder).encode()).hexdigest()
+    last_modified = max((row['active_at'] for row in rows if 'active_at' in row), default=None)
+    return '"{}"'.format(digest), last_modified and int(last_modified.timestamp())
+
+
+def conditional(request, rows, build, *extra):
+    """
+    304 when the client holds the current version of the rows, without running build();
+    otherwise build()'s data as JSON with the validators attached.
+    """
+    etag, last_modified = validators(rows, *extra)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = JsonResponse(build())
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    # Stored, but revalidated every time.
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+def serialize(row, fields):
+    item = {}
+    for field in fields:
+        if field == 'author':
+            item['author'] = {'id': row['author__user_id'], 'name': row['author__name']}
+        elif field != 'tags':
+            item[field] = row[field]
+    return item
+
+
+def project(queryset, fields, columns):
+    """The rows of queryset as {id: item}, reading only the columns behind the fields."""
+    rows = queryset.values(*{column for field in fields for column in columns[field]} | {'id'})
+    return {row['id']: serialize(row, fields) for row in rows}
+
+
+def questions(ids, fields):
+    items = project(Question.objects.filter(id__in=ids), fields, QUESTION_COLUMNS)
+    if 'tags' in fields:
+        tags = defaultdict(list)
+        through = Question.tags.through.objects.filter(question_id__in=ids).order_by('tag__tag')
+        for question_id, tag in through.values_list('question_id', 'tag__tag'):
+            tags[question_id].append(tag)
+        for question_id, item in items.items():
+            item['tags'] = tags[question_id]
+    return [items[pk] for pk in ids if pk in items]
+
+
+def questions_page(request, page, rows, fields):
+    return conditional(request, rows, lambda: {
+        'results': questions([row['id'] for row in rows], fields),
+        'next': page.next_cursor,
+        'previous': page.previous_cursor,
+    }, page.next_cursor, page.previous_cursor)
+
+
+def question_feed(request, feed):
+    """A cursor page of a Question feed; the page query reads the validators along with the sort keys."""
+    fields = requested_fields(request, QUESTION_COLUMNS, FEED_FIELDS)
+    page = cursor_page(request, feed.values(*QUESTION_VALIDATORS, *[key.lstrip('-') for key in feed.query.order_by]))
+    rows = [{field: row[field] for field in QUESTION_VALIDATORS} for row in page]
+    return questions_page(request, page, rows, fields)
+
+
+@api_view
+def new_questions(request):
+    return question_feed(request, Question.objects.new())
+
+
+@api_view
+def hot_questions(request):
+    return question_feed(request, Question.objects.hot())
+
+
+@api_view
+def author_questions(request, author):
+    return question_feed(request, Question.objects.author(author))
+
+
+@api_view
+def tag_questions(request, tag):
+    fields = requested_fields(request, QUESTION_COLUMNS, FEED_FIELDS)
+    tag_id = Tag.objects.filter(tag=tag).values_list('id', flat=True).first()
+    if tag_id is None:
+        raise ApiError('no such tag', status=404)
+    feed = TagFeed.objects.hot(tag_id) if request.GET.get('sort') == 'hot' else TagFeed.objects.new(tag_id)
+
+    page = cursor_page(request, feed.values('id', 'date', 'rating', 'question_id'))
+    ids = [row['question_id'] for row in page]
+    loaded = {row['id']: row for row in Question.objects.filter(id__in=ids).values(*QUESTION_VALIDATORS)}
+    return questions_page(request, page, [loaded[pk] for pk in ids if pk in loaded], fields)
+
+
+@api_view
+def question_detail(request, pk):
+    fields = requested_fields(request, QUESTION_COLUMNS, DETAIL_FIELDS)
+    row = Question.objects.filter(id=pk).values(*QUESTION_VALIDATORS).first()
+    if row is None:
+        raise ApiError('no such question', status=404)
+    return conditional(request, [row], lambda: questions([pk], fields)[0])
+
+
+@api_view
+def question_answers(request, pk):
+    fields = requested_fields(request, ANSWER_COLUMNS, ANSWER_FIELDS)
+    # Answer votes do not touch the question, so there is no Last-Modified to send here.
+    question = Question.objects.filter(id=pk).values('version').first()
+    if question is None:
+        raise ApiError('no such question', status=404)
+    page = cursor_page(request, Answer.objects.filter(question_id=pk).order_by('-rating', '-id')
+                       .values(*ANSWER_VALIDATORS))
+    rows = list(page) + [question]
+
+    def build():
+        items = project(Answer.objects.filter(id__in=[row['id'] for row in page]), fields, ANSWER_COLUMNS)
+        return {
+            'results': [items[row['id']] for row in page if row['id'] in items],
+            'next': page.next_cursor,
+            'previous': page.previous_cursor,
+        }
+
+    return conditional(request, rows, build, page.next_cursor, page.previous_cursor)
@@ -0,0 +1,52 @@
+import posixpath
+import re
+
+import rcssmin
+import rjsmin
+from django.conf import settings
+from django.contrib.staticfiles import finders
+
+CSS_URL = re.compile(r'''url\(\s*(['"]?)(?!data:|https?:|//|/|#)([^'")]+)\1\s*\)''')
+CSS_IMPORT = re.compile(r'@import\s+[^;]+;')
+SOURCE_MAP = re.compile(r'^\s*(?://|/\*)#\s*sourceMappingURL=.*$', re.MULTILINE)
+
+
+def read_source(path):
+    found = finders.find(path)
+    if found is None:
+        raise FileNotFoundError('Static file {} of a bundle was not found'.format(path))
+    with open(found, encoding='utf-8') as source:
+        return source.read()
+
+
+def rebase_urls(css, source, bundle):
+    """Rewrite relative url() references of source so they still resolve from the bundle's directory."""
+    def rebase(match):
+        target = posixpath.normpath(posixpath.join(posixpath.dirname(source), match.group(2)))
+        return 'url({0}{1}{0})'.format(match.group(1), posixpath.relpath(target, posixpath.dirname(bundle)))
+    return CSS_URL.sub(rebase, css)
+
+
+def build_css(bundle, sources):
+    imports, parts = [], []
+    for path in sources:
+        css = rebase_urls(SOURCE_MAP.sub('', read_source(path)), path, bundle)
+        # @import is only valid at the top of a stylesheet
+        imports.extend(CSS_IMPORT.findall(css))
+        parts.append(CSS_IMPORT.sub('', css))
+    return rcssmin.cssmin('\n'.join(imports + parts))
+
+
+def build_js(bundle, sources):
+    return ';\n'.join(rjsmin.jsmin(SOURCE_MAP.sub('', read_source(path))).rstrip(';\n') for path in sources) + ';\n'
+
+
+def build_bundles():
+    """Write every STATIC_BUNDLES entry into the first STATICFILES_DIRS entry; returns the bundle names."""
+    root = settings.STATICFILES_DIRS[0]
+    for bundle, sources in settings.STATIC_BUNDLES.items():
+        content = build_css(bundle, sources) if bundle.endswith('.css') else build_js(bundle, sources)
+        target = root / bundle
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_text(content, encoding='utf-8')
+    return list(settings.STATIC_BUNDLES)
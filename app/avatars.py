@@ -0,0 +1,89 @@
+import hashlib
+import os
+import re
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+from app.models import Author
+
+SIZES = (80, 100, 200)
+# (extension, Pillow format, save options)
+FORMATS = (
+    ('webp', 'WEBP', {'quality': 80, 'method': 6}),
+    ('jpg', 'JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+)
+DEFAULT_AVATAR = 'static/img/user.png'
+DERIVATIVE = re.compile(r'-({})\.({})$'.format('|'.join(map(str, SIZES)), '|'.join(ext for ext, _, _ in FORMATS)))
+
+
+def derivative_name(name, size, ext):
+    return '{}-{}.{}'.format(os.path.splitext(name or DEFAULT_AVATAR)[0], size, ext)
+
+
+def is_derivative(name):
+    return bool(DERIVATIVE.search(name))
+
+
+def fit_size(size):
+    """Smallest stored size covering the requested one."""
+    return next((stored for stored in SIZES if stored >= size), SIZES[-1])
+
+
+def encode(image, size, pil_format, options):
+    thumbnail = ImageOps.fit(image, (size, size), Image.LANCZOS)
+    if pil_format == 'JPEG' and thumbnail.mode != 'RGB':
+        background = Image.new('RGB', thumbnail.size, 'white')
+        background.paste(thumbnail, mask=thumbnail.getchannel('A') if 'A' in thumbnail.getbands() else None)
+        thumbnail = background
+    buffer = BytesIO()
+    thumbnail.save(buffer, pil_format, **options)
+    return buffer.getvalue()
+
+
+def make_derivatives(name, image, force=True):
+    """Store every size and format of the image next to the original; returns how many were written."""
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+
+    written = 0
+    for size in SIZES:
+        for ext, pil_format, options in FORMATS:
+            path = derivative_name(name, size, ext)
+            if default_storage.exists(path):
+                if not force:
+                    continue
+                default_storage.delete(path)
+            default_storage.save(path, ContentFile(encode(image, size, pil_format, options)))
+            written += 1
+    return written
+
+
+def store_avatar(author, upload):
+    """
+    Save an uploaded avatar under a name derived from its content, so the original and
+    its derivatives can be served with a far-future cache lifetime. Returns the name for
+    the avatar job, which writes the derivatives and only then switches author.avatar.
+    """
+    data = upload.read()
+    image = Image.open(BytesIO(data))
+
+    ext = os.path.splitext(upload.name)[1].lower() or '.' + image.format.lower()
+    filename = hashlib.sha256(data).hexdigest()[:16] + ext
+    name = author.avatar.field.generate_filename(author, filename)
+    if not default_storage.exists(name):
+        name = default_storage.save(name, ContentFile(data))
+    return name
+
+
+def process_avatar(author_id, name):
+    with default_storage.open(name) as original, Image.open(original) as image:
+        image.load()
+        make_derivatives(name, image, force=False)
+    author = Author.objects.filter(id=author_id).first()
+    if author is not None:
+        author.avatar.name = name
+        # post_save drops the cached user snapshot
+        author.save(update_fields=['avatar'])
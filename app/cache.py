@@ -0,0 +1,143 @@
+import asyncio
+import hashlib
+import uuid
+from collections import namedtuple
+from functools import wraps
+from urllib.parse import unquote
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import prefetch_related_objects
+from django.template.loader import render_to_string
+from app.concurrency import run_sync
+from app.models import Author, Tag
+
+POPULAR_TAGS_KEY = 'right_column:tags'
+POPULAR_MEMBERS_KEY = 'right_column:members'
+
+PopularMember = namedtuple('PopularMember', ['user_id', 'name'])
+
+
+def popular_tags():
+    tags = cache.get(POPULAR_TAGS_KEY)
+    if tags is None:
+        tags = list(Tag.objects.popular_tags().values_list('tag', flat=True))
+        cache.set(POPULAR_TAGS_KEY, tags, settings.RIGHT_COLUMN_CACHE_TIMEOUT)
+    return tags
+
+
+def popular_members():
+    members = cache.get(POPULAR_MEMBERS_KEY)
+    if members is None:
+        members = [PopularMember(*row) for row in Author.objects.popular_users().values_list('user_id', 'name')]
+        cache.set(POPULAR_MEMBERS_KEY, members, settings.RIGHT_COLUMN_CACHE_TIMEOUT)
+    return members
+
+
+def invalidate_popular_tags():
+    cache.delete(POPULAR_TAGS_KEY)
+
+
+def invalidate_popular_members():
+    cache.delete(POPULAR_MEMBERS_KEY)
+
+
+def user_key(user_id):
+    return 'auth_user:{}'.format(user_id)
+
+
+def invalidate_user(user_id):
+    cache.delete(user_key(user_id))
+
+
+# Bump when inc/one_question.html changes, so cards rendered by the old template are not served.
+CARD_MARKUP_VERSION = 3
+
+
+def question_card_key(question, style):
+    author = question.author
+    author_digest = hashlib.md5('{}|{}'.format(author.avatar.name, author.name).encode()).hexdigest()[:12]
+    return 'card:{}:{}:{}:{}:{}'.format(CARD_MARKUP_VERSION, int(bool(style)), question.id, question.version,
+                                        author_digest)
+
+
+def render_question_cards(questions, style):
+    """Rendered inc/one_question.html for every question, one cache round trip for the whole page."""
+    questions = list(questions)
+    keys = [question_card_key(question, style) for question in questions]
+    cards = cache.get_many(keys)
+
+    missing = [(key, question) for key, question in zip(keys, questions) if key not in cards]
+    if missing:
+        prefetch_related_objects([question for _, question in missing], 'tags')
+        rendered = {
+            key: render_to_string('inc/one_question.html', {'question': question, 'style': style})
+            for key, question in missing
+        }
+        cache.set_many(rendered, settings.QUESTION_CARD_CACHE_TIMEOUT)
+        cards.update(rendered)
+
+    return [cards[key] for key in keys]
+
+
+def page_generation_key(path):
+    return 'page_generation:' + hashlib.md5(path.encode()).hexdigest()
+
+
+def purge_pages(*paths):
+    """Drop every cached variant (?page, cursors) of the given paths."""
+    cache.set_many({page_generation_key(unquote(path)): uuid.uuid4().hex for path in paths}, None)
+
+
+def page_generation(path):
+    key = page_generation_key(path)
+    generation = cache.get(key)
+    if generation is None:
+        # Never purged or evicted: a new generation, so pages cached under a purged one are not served.
+        cache.add(key, uuid.uuid4().hex, None)
+        generation = cache.get(key)
+    return generation
+
+
+def cached_page(request):
+    """Cache key and cached response of a page; no key when the response must not be shared."""
+    if request.method != 'GET' or request.user.is_authenticated:
+        return None, None
+
+    generation = page_generation(request.path)
+    key = 'page:{}:{}'.format(generation, hashlib.md5(request.get_full_path().encode()).hexdigest())
+    return key, cache.get(key)
+
+
+def store_page(key, response):
+    if response.status_code == 200 and not response.cookies and not response.streaming:
+        cache.set(key, response, settings.PAGE_CACHE_TIMEOUT)
+
+
+def cache_anonymous_page(view):
+    """
+    Serve GET requests of logged-out visitors from the cache, keyed by the full path and
+    a per-path generation that purge_pages() replaces. Works for sync and async views.
+    """
+    if asyncio.iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            key, response = await run_sync(cached_page, request)
+            if response is None:
+                response = await view(request, *args, **kwargs)
+                if key is not None:
+                    await run_sync(store_page, key, response)
+            return response
+
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key, response = cached_page(request)
+        if response is None:
+            response = view(request, *args, **kwargs)
+            if key is not None:
+                store_page(key, response)
+        return response
+
+    return wrapper
@@ -0,0 +1,37 @@
+import asyncio
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections, connection
+
+
+def isolated(func):
+    """func on a pool thread with that thread's own database connection, closed again when it is stale."""
+    def call():
+        close_old_connections()
+        try:
+            return func()
+        finally:
+            close_old_connections()
+    return call
+
+
+def in_transaction():
+    return connection.in_atomic_block
+
+
+async def gather_sync(*calls):
+    """
+    Run the blocking no-argument calls concurrently from an async view, one pool thread each.
+
+    Inside a transaction (ATOMIC_REQUESTS, a TestCase) other connections cannot see its
+    uncommitted rows, so the calls then run one after another on the request's connection.
+    """
+    if await sync_to_async(in_transaction, thread_sensitive=True)():
+        return [await sync_to_async(call, thread_sensitive=True)() for call in calls]
+    return await asyncio.gather(*(sync_to_async(isolated(call), thread_sensitive=False)() for call in calls))
+
+
+async def run_sync(func, *args, **kwargs):
+    result, = await gather_sync(partial(func, *args, **kwargs))
+    return result
@@ -1,6 +1,13 @@
 from django import forms
+from django.urls import reverse
+from django.db import transaction
 from django.db.models import F
+from django.db.models.functions import Now
 from app.models import Author, Answer, Question, LikeAnswer, LikeQuestion, Tag
+from app.cache import purge_pages
+from app.jobs import bump, enqueue
+from app.live import publish_answer
+from app.avatars import store_avatar
 from django.contrib.auth.models import User
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
 
@@ -25,12 +32,10 @@ class RegisterForm(UserCreationForm):
 
     def save(self, commit=False):
         user = super().save(commit=True)
+        author = Author.objects.create(user=user, name=self.cleaned_data.get('first_name'))
         photo = self.files.get('avatar')
-        print(photo)
         if photo:
-            Author.objects.create(user=user, name=self.cleaned_data.get('first_name'), avatar=photo)
-        else:
-            Author.objects.create(user=user, name=self.cleaned_data.get('first_name'))
+            enqueue('avatar', [{'author_id': author.id, 'name': store_avatar(author, photo)}])
         if commit:
             user.save()
         return user
@@ -50,20 +55,31 @@ class AskQuestion(forms.ModelForm):
         self.author = author
         super().__init__(*args, **kwargs)
 
+    def clean_tags(self):
+        tags = list(dict.fromkeys(self.cleaned_data['tags'].lower().split()))
+        max_length = Tag._meta.get_field('tag').max_length
+        too_long = [tag for tag in tags if len(tag) > max_length]
+        if too_long:
+            raise forms.ValidationError('Tags are limited to {} characters: {}'.format(max_length, ', '.join(too_long)))
+        return tags
+
     def save(self, commit=True):
         question = super().save(commit=False)
         question.author = self.author
-        Author.objects.filter(id=question.author_id).update(count=F('count') + 1)
+        if not commit:
+            return question
 
-        if commit:
+        tags = self.cleaned_data['tags']
+        with transaction.atomic():
             question.save()
-            for tag in self.cleaned_data['tags'].split(' '):
-                try:
-                    idtag = Tag.objects.get(tag=tag).id
-                    Tag.objects.filter(id=idtag).update(count=F('count') + 1)
-                except Tag.DoesNotExist:
-                    idtag = Tag.objects.create(name=tag).id
-                question.tags.add(idtag)
+            tag_ids = Tag.objects.upsert(tags)
+            question.tags.add(*tag_ids)
+            bump(Tag, 'count', dict.fromkeys(tag_ids, 1))
+            bump(Author, 'count', {question.author_id: 1})
+            enqueue('search_index', [{'question_id': question.id}])
+            transaction.on_commit(lambda: purge_pages(
+                reverse('new'), *(reverse('tag', kwargs={'tag': tag}) for tag in tags)
+            ))
 
         return question
 
@@ -85,10 +101,16 @@ class AnswerForm(forms.ModelForm):
         answer = super().save(commit=False)
         answer.question = self.question
         answer.author = self.author
-        Author.objects.filter(id=answer.author_id).update(count=F('count') + 1)
 
         if commit:
-            answer.save()
+            with transaction.atomic():
+                answer.save()
+                # Read right after the redirect to ?page=last, so not deferred to a job
+                Question.objects.filter(id=answer.question_id).update(answers_count=F('answers_count') + 1,
+                                                                       version=F('version') + 1, active_at=Now())
+                bump(Author, 'count', {answer.author_id: 1})
+            transaction.on_commit(lambda: purge_pages(reverse('question', kwargs={'pk': answer.question_id})))
+            transaction.on_commit(lambda: publish_answer(answer))
 
         return answer
 
@@ -106,8 +128,7 @@ class SettingsForm(forms.ModelForm):
         photo = self.files.get('avatar')
         if photo:
             author = Author.objects.get(user_id=user.id)
-            author.avatar = self.files.get('avatar')
-            author.save()
+            enqueue('avatar', [{'author_id': author.id, 'name': store_avatar(author, photo)}])
 
         if commit:
             user.save()
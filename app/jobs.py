@@ -0,0 +1,154 @@
+import logging
+import os
+import socket
+import threading
+import uuid
+from collections import defaultdict
+
+from django.apps import apps
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from app.avatars import process_avatar
+from app.cache import invalidate_popular_members, invalidate_popular_tags
+from app.models import Job
+from app.search import index_questions
+
+logger = logging.getLogger(__name__)
+
+HANDLERS = {}
+
+
+def handler(kind):
+    """Register func(payloads) as the handler of a job kind; it gets every claimed job of that kind at once."""
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+def enqueue(kind, payloads):
+    """
+    Store the jobs in the current transaction, so they exist exactly when the write that caused
+    them does, and wake the in-process worker once it commits.
+    """
+    Job.objects.bulk_create([Job(kind=kind, payload=payload) for payload in payloads])
+    transaction.on_commit(wake)
+
+
+def bump(model, field, counts):
+    """Enqueue counter increments, {pk: delta}, for one integer field of a model."""
+    enqueue('counter', [
+        {'model': model._meta.label, 'field': field, 'id': pk, 'delta': delta} for pk, delta in counts.items()
+    ])
+
+
+def pending_counts(model, field, lock=False):
+    """
+    Deltas of the counter bumps for one field of a model that are queued but not applied yet,
+    {pk: delta}. With lock, the jobs cannot be applied until the current transaction ends.
+    """
+    jobs = Job.objects.filter(kind='counter', failed_at=None, payload__model=model._meta.label, payload__field=field)
+    if lock:
+        jobs = jobs.select_for_update()
+    counts = defaultdict(int)
+    for payload in jobs.values_list('payload', flat=True):
+        counts[payload['id']] += payload['delta']
+    return {pk: delta for pk, delta in counts.items() if delta}
+
+
+def worker_name():
+    return '{}:{}:{}'.format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+
+
+def run_jobs(worker, batch_size=None):
+    """Claim and run one batch of due jobs, grouped by kind; returns how many were claimed."""
+    jobs = Job.objects.claim(worker, batch_size or settings.JOBS_BATCH_SIZE, settings.JOBS_LEASE_SECONDS)
+    by_kind = defaultdict(list)
+    for job in jobs:
+        by_kind[job.kind].append(job)
+
+    for kind, batch in by_kind.items():
+        if not run_batch(kind, batch) and len(batch) > 1:
+            # One bad payload must not hold back the rest, so retry them one by one.
+            for job in batch:
+                run_batch(kind, [job])
+    return len(jobs)
+
+
+def run_batch(kind, jobs):
+    try:
+        with transaction.atomic():
+            HANDLERS[kind]([job.payload for job in jobs])
+            Job.objects.filter(id__in=[job.id for job in jobs]).delete()
+    except Exception as e:
+        logger.exception('%s jobs %s failed', kind, [job.id for job in jobs])
+        if len(jobs) == 1:
+            Job.objects.retry(jobs, repr(e), settings.JOBS_MAX_ATTEMPTS, settings.JOBS_RETRY_DELAY)
+        return False
+    return True
+
+
+class InProcessWorker(threading.Thread):
+    """Drains the queue from inside a web process, woken on commit and every JOBS_POLL_INTERVAL seconds."""
+
+    def __init__(self):
+        super().__init__(name='askme-jobs', daemon=True)
+        self.wakeup = threading.Event()
+        self.worker = worker_name()
+
+    def run(self):
+        while True:
+            self.wakeup.wait(settings.JOBS_POLL_INTERVAL)
+            self.wakeup.clear()
+            try:
+                while run_jobs(self.worker):
+                    pass
+            except Exception:
+                logger.exception('Job worker loop failed')
+            finally:
+                close_old_connections()
+
+
+in_process_worker = None
+worker_lock = threading.Lock()
+
+
+def wake():
+    global in_process_worker
+    if not settings.JOBS_IN_PROCESS:
+        return
+    with worker_lock:
+        if in_process_worker is None:
+            in_process_worker = InProcessWorker()
+            in_process_worker.start()
+    in_process_worker.wakeup.set()
+
+
+@handler('counter')
+def apply_counters(payloads):
+    """Every bump of one model field summed per row and applied in a single UPDATE."""
+    deltas = defaultdict(lambda: defaultdict(int))
+    for payload in payloads:
+        deltas[payload['model'], payload['field']][payload['id']] += payload['delta']
+
+    for (label, field), by_id in deltas.items():
+        model = apps.get_model(label)
+        change = Case(*(When(id=pk, then=Value(delta)) for pk, delta in by_id.items()),
+                      default=Value(0), output_field=IntegerField())
+        model.objects.filter(id__in=list(by_id)).update(**{field: F(field) + change})
+        if label == 'app.Tag':
+            transaction.on_commit(invalidate_popular_tags)
+        elif label == 'app.Author':
+            transaction.on_commit(invalidate_popular_members)
+
+
+@handler('search_index')
+def index_search(payloads):
+    index_questions(sorted({payload['question_id'] for payload in payloads}))
+
+
+@handler('avatar')
+def process_avatars(payloads):
+    for payload in payloads:
+        process_avatar(payload['author_id'], payload['name'])
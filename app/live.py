@@ -0,0 +1,343 @@
+import asyncio
+import json
+import logging
+import re
+import threading
+from datetime import timedelta
+from urllib.parse import parse_qs
+
+from django.conf import settings
+from django.db.models import Max
+from django.template.loader import render_to_string
+from django.utils import timezone
+from app.concurrency import run_sync
+from app.models import Answer, Question
+
+logger = logging.getLogger(__name__)
+
+STREAM_PATH = re.compile(r'^/question/(?P<pk>\d+)/live/$')
+
+
+def answer_event(answer):
+    return {'event': 'answer', 'id': answer.id, 'data': {
+        'id': answer.id,
+        'rating': answer.rating,
+        'html': render_to_string('inc/comment.html', {'comment': answer}),
+    }}
+
+
+def rating_event(target, target_id, rating):
+    return {'event': 'rating', 'id': None, 'data': {'target': target, 'id': target_id, 'rating': rating}}
+
+
+def encode_event(event):
+    lines = [] if event['id'] is None else ['id: {}'.format(event['id'])]
+    lines += ['event: {}'.format(event['event']), 'data: {}'.format(json.dumps(event['data']))]
+    return '\n'.join(lines).encode() + b'\n\n'
+
+
+def answers_since(question_id, since_id, limit):
+    """
+    Events for up to limit answers of the question after since_id, and the cursor to continue
+    from; without since_id no events and the newest answer id. None for a missing question.
+    """
+    if not Question.objects.filter(id=question_id).exists():
+        return None
+    answers = Answer.objects.filter(question_id=question_id)
+    if since_id is None:
+        return [], answers.aggregate(last_id=Max('id'))['last_id'] or 0
+    answers = list(answers.filter(id__gt=since_id).select_related('author').order_by('id')[:limit])
+    return [answer_event(answer) for answer in answers], answers[-1].id if answers else since_id
+
+
+def changes_since(cursors, since):
+    """
+    Answers and questions of the watched questions, {question_id: last_answer_id}, created or
+    voted since the given time: new answers as events, and the current ratings of the rest.
+    """
+    answers = Answer.objects.filter(question_id__in=list(cursors), active_at__gte=since).select_related('author')
+    events, ratings = [], []
+    for answer in answers.order_by('id'):
+        if answer.id > cursors[answer.question_id]:
+            events.append((answer.question_id, answer_event(answer)))
+        else:
+            ratings.append((answer.question_id, 'answer', answer.id, answer.rating))
+    ratings += [
+        (question_id, 'question', question_id, rating) for question_id, rating in
+        Question.objects.filter(id__in=list(cursors), active_at__gte=since).values_list('id', 'rating')
+    ]
+    return events, ratings
+
+
+class Subscriber:
+    """One open stream or long poll; events are handed over on the event loop it waits on."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.queue = asyncio.Queue(settings.LIVE_QUEUE_SIZE)
+        self.lagged = False
+
+    def deliver(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # A client this far behind reconnects and catches up from the database instead.
+            self.lagged = True
+
+    def push(self, event):
+        self.loop.call_soon_threadsafe(self.deliver, event)
+
+
+class Channel:
+    def __init__(self):
+        self.subscribers = set()
+        self.answer_ids = set()
+        # Set by the first catch-up, the poller only looks past it.
+        self.last_answer_id = None
+        self.ratings = {}
+
+
+class Broker:
+    """
+    Subscribers of this process by question. An event is built once per process and fanned out
+    to every local subscriber; publish() may be called from any thread. Writes made by other
+    worker processes are picked up by poll(), one round of queries for all watched questions
+    that only reads the answers and questions active since the previous round.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.channels = {}
+        self.poller = None
+
+    def subscribe(self, question_id):
+        subscriber = Subscriber(asyncio.get_event_loop())
+        with self.lock:
+            self.channels.setdefault(question_id, Channel()).subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, question_id, subscriber):
+        with self.lock:
+            channel = self.channels.get(question_id)
+            if channel is not None:
+                channel.subscribers.discard(subscriber)
+                if not channel.subscribers:
+                    del self.channels[question_id]
+
+    def watched(self, question_id):
+        with self.lock:
+            return question_id in self.channels
+
+    def seen(self, question_id, answer_id):
+        with self.lock:
+            channel = self.channels.get(question_id)
+            if channel is not None:
+                channel.last_answer_id = max(channel.last_answer_id or 0, answer_id)
+
+    def publish(self, question_id, event):
+        with self.lock:
+            channel = self.channels.get(question_id)
+            if channel is None:
+                return
+            if event['event'] == 'answer':
+                if event['id'] in channel.answer_ids:
+                    return
+                channel.answer_ids.add(event['id'])
+                channel.last_answer_id = max(channel.last_answer_id or 0, event['id'])
+            else:
+                data = event['data']
+                channel.ratings[data['target'], data['id']] = data['rating']
+            subscribers = list(channel.subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.push(event)
+            except RuntimeError:
+                # Its event loop is already closed.
+                pass
+
+    def publish_ratings(self, ratings):
+        """Rating events for the polled values, but not again for one the channel already sent."""
+        changed = []
+        with self.lock:
+            for question_id, target, target_id, rating in ratings:
+                channel = self.channels.get(question_id)
+                if channel is not None and channel.ratings.get((target, target_id)) != rating:
+                    changed.append((question_id, rating_event(target, target_id, rating)))
+        for question_id, event in changed:
+            self.publish(question_id, event)
+
+    def start_polling(self):
+        if settings.LIVE_POLL_INTERVAL and (self.poller is None or self.poller.done()):
+            self.poller = asyncio.ensure_future(self.poll())
+
+    async def poll(self):
+        # Each round reads the rows active since the previous one started. Rows written a little
+        # earlier may have committed after it, so LIVE_POLL_OVERLAP seconds are read twice;
+        # publish() and publish_ratings() drop what was already sent.
+        overlap = timedelta(seconds=settings.LIVE_POLL_OVERLAP)
+        since = timezone.now() - overlap
+        while True:
+            await asyncio.sleep(settings.LIVE_POLL_INTERVAL)
+            with self.lock:
+                if not self.channels:
+                    return
+                cursors = {
+                    question_id: channel.last_answer_id
+                    for question_id, channel in self.channels.items() if channel.last_answer_id is not None
+                }
+            started = timezone.now()
+            if not cursors:
+                since = started - overlap
+                continue
+            try:
+                events, ratings = await run_sync(changes_since, cursors, since)
+            except Exception:
+                logger.exception('Polling answers of %s failed', list(cursors))
+                continue
+            since = started - overlap
+            for question_id, event in events:
+                self.publish(question_id, event)
+            self.publish_ratings(ratings)
+
+
+broker = Broker()
+
+
+def publish_answer(answer):
+    if broker.watched(answer.question_id):
+        broker.publish(answer.question_id, answer_event(answer))
+
+
+def publish_rating(question_id, target, target_id, rating):
+    broker.publish(question_id, rating_event(target, target_id, rating))
+
+
+def parse_since_id(value):
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+
+async def catch_up(question_id, since_id):
+    """Every answer after since_id, read page by page; None for a missing question."""
+    events = []
+    while True:
+        caught = await run_sync(answers_since, question_id, since_id, settings.LIVE_BATCH_SIZE)
+        if caught is None:
+            return None
+        batch, cursor = caught
+        events += batch
+        if since_id is None or len(batch) < settings.LIVE_BATCH_SIZE:
+            broker.seen(question_id, cursor)
+            return events, cursor
+        since_id = cursor
+
+
+def queued_events(subscriber, cursor):
+    """What the subscriber got meanwhile, minus answers the catch-up already returned."""
+    events = []
+    while not subscriber.queue.empty():
+        event = subscriber.queue.get_nowait()
+        if event['event'] != 'answer' or event['id'] > cursor:
+            events.append(event)
+    return events
+
+
+async def wait_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def stream_answers(question_id, scope, receive, send):
+    headers = dict(scope['headers'])
+    since_id = parse_since_id(headers.get(b'last-event-id', b'').decode('latin-1')) or parse_since_id(
+        parse_qs(scope['query_string'].decode('latin-1')).get('since_id', [''])[0])
+
+    subscriber = broker.subscribe(question_id)
+    broker.start_polling()
+    disconnected = asyncio.ensure_future(wait_disconnect(receive))
+    try:
+        caught = await catch_up(question_id, since_id)
+        if caught is None:
+            await send({'type': 'http.response.start', 'status': 404,
+                        'headers': [(b'content-type', b'text/plain; charset=utf-8')]})
+            await send({'type': 'http.response.body', 'body': b'Not found'})
+            return
+        events, cursor = caught
+
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            # Tells nginx not to buffer the stream.
+            (b'x-accel-buffering', b'no'),
+        ]})
+        body = 'retry: {}\n\n'.format(settings.LIVE_RETRY_MS).encode()
+        body += b''.join(encode_event(event) for event in events + queued_events(subscriber, cursor))
+        await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+
+        while not subscriber.lagged:
+            received = asyncio.ensure_future(subscriber.queue.get())
+            done, _ = await asyncio.wait({received, disconnected}, timeout=settings.LIVE_HEARTBEAT_INTERVAL,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if received not in done:
+                received.cancel()
+                if disconnected in done:
+                    return
+                # Keeps proxies from closing an idle stream and finds clients that went away.
+                await send({'type': 'http.response.body', 'body': b': ping\n\n', 'more_body': True})
+                continue
+            event = received.result()
+            if event['event'] != 'answer' or event['id'] > cursor:
+                await send({'type': 'http.response.body', 'body': encode_event(event), 'more_body': True})
+
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        disconnected.cancel()
+        broker.unsubscribe(question_id, subscriber)
+
+
+class LiveApplication:
+    """
+    ASGI entry point. Answer streams (GET question/<pk>/live/ asking for text/event-stream) are
+    served here as long-lived coroutines, without a thread or a database connection each;
+    everything else, the long-polling fallback on the same URL included, goes to Django.
+    """
+
+    def __init__(self, application):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and scope['method'] == 'GET':
+            match = STREAM_PATH.match(scope['path'])
+            if match and b'text/event-stream' in dict(scope['headers']).get(b'accept', b''):
+                return await stream_answers(int(match['pk']), scope, receive, send)
+        return await self.application(scope, receive, send)
+
+
+async def long_poll(question_id, since_id):
+    """
+    Answer and rating events after since_id, waiting up to LIVE_LONG_POLL_TIMEOUT for one, and
+    the cursor for the next poll; None for a missing question.
+    """
+    subscriber = broker.subscribe(question_id)
+    try:
+        caught = await catch_up(question_id, since_id)
+        if caught is None:
+            return None
+        events, cursor = caught
+        events += queued_events(subscriber, cursor)
+        if events or since_id is None:
+            return events, cursor
+
+        try:
+            events = [await asyncio.wait_for(subscriber.queue.get(), settings.LIVE_LONG_POLL_TIMEOUT)]
+        except asyncio.TimeoutError:
+            # Nothing from this process; answers posted through another one are still in the database.
+            return await catch_up(question_id, cursor)
+        events += queued_events(subscriber, cursor)
+    finally:
+        broker.unsubscribe(question_id, subscriber)
+
+    events = [event for event in events if event['event'] != 'answer' or event['id'] > cursor]
+    return events, max([cursor] + [event['id'] for event in events if event['event'] == 'answer'])
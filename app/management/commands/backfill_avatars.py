@@ -0,0 +1,35 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from PIL import Image, UnidentifiedImageError
+from app.avatars import DEFAULT_AVATAR, is_derivative, make_derivatives
+
+
+class Command(BaseCommand):
+    help = 'Create the resized WebP/JPEG derivatives of the default avatar and of every file in uploads/avatars/'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Regenerate derivatives that already exist')
+
+    def originals(self):
+        yield DEFAULT_AVATAR
+        root = os.path.join(settings.MEDIA_ROOT, 'avatars')
+        for directory, _, filenames in os.walk(root):
+            for filename in sorted(filenames):
+                name = os.path.relpath(os.path.join(directory, filename), settings.MEDIA_ROOT).replace(os.sep, '/')
+                if not is_derivative(name):
+                    yield name
+
+    def handle(self, *args, **options):
+        files = written = 0
+        for name in self.originals():
+            try:
+                with Image.open(os.path.join(settings.MEDIA_ROOT, name)) as image:
+                    image.load()
+                    written += make_derivatives(name, image, force=options['force'])
+            except (OSError, UnidentifiedImageError) as e:
+                self.stderr.write('Skipped {}: {}'.format(name, e))
+                continue
+            files += 1
+        self.stdout.write('Wrote {} derivatives of {} avatars'.format(written, files))
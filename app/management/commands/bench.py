@@ -0,0 +1,247 @@
+import json
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import SimpleCookie
+from importlib import import_module
+from random import Random
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import HTTPRedirectHandler, Request, build_opener
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.urls import resolve, Resolver404
+from app.metrics import RequestStats, current_stats, instrument_connection
+from app.models import Question, Author, Tag
+
+# (method, path template, weight); templates are filled from the current database
+PROFILE = [
+    ('GET', '/', 30),
+    ('GET', '/hot/', 20),
+    ('GET', '/tag/{tag}', 15),
+    ('GET', '/question/{question}/?page={page}', 25),
+    ('GET', '/author/{author}/', 8),
+    ('POST', '/ask/', 2),
+]
+
+
+class NoRedirect(HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+class Command(BaseCommand):
+    help = 'Replay a request mix against the views and report latency percentiles and SQL per endpoint as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--db_size', type=str, help='Fill the database with renderData of this size first')
+        parser.add_argument('--requests', type=str, help='JSON lines file of {"method", "path", "data"} to replay')
+        parser.add_argument('--count', type=int, default=500, help='Requests to send')
+        parser.add_argument('--seed', type=int, default=0, help='Seed for the request mix')
+        parser.add_argument('--url', type=str, help='Send the requests to a running server instead of the test client; '
+                                                    'it has to use this database, POSTs log in through it')
+        parser.add_argument('--concurrency', type=int, default=1, help='Parallel requests in --url mode')
+        parser.add_argument('--authenticated', action='store_true', help='Send GET requests as a logged-in user')
+        parser.add_argument('--clear_cache', action='store_true', help='Start from an empty cache')
+        parser.add_argument('--output', type=str, help='Write the JSON report to this file')
+
+    def samples(self, rng):
+        # Read in a fixed order and drawn with the seeded generator, so --seed repeats the mix
+        # on the same database (--db_size regenerates it from the same seed).
+        questions = list(Question.objects.order_by('id').values_list('id', flat=True))
+        authors = list(Author.objects.order_by('id').values_list('user_id', flat=True))
+        tags = list(Tag.objects.order_by('-count', 'id').values_list('tag', flat=True)[:10])
+        if not questions or not authors or not tags:
+            raise CommandError('Database is empty, pass --db_size or fill it with renderData first')
+        return rng.sample(questions, min(200, len(questions))), rng.sample(authors, min(50, len(authors))), tags
+
+    def profile_requests(self, count, rng):
+        questions, authors, tags = self.samples(rng)
+        templates = [(method, path) for method, path, weight in PROFILE for _ in range(weight)]
+        for _ in range(count):
+            method, template = rng.choice(templates)
+            path = template.format(
+                tag=rng.choice(tags),
+                question=rng.choice(questions),
+                page=rng.choice(['1', '2', '3', 'last']),
+                author=rng.choice(authors),
+            )
+            data = None
+            if method == 'POST':
+                data = {
+                    'title': 'Benchmark question {}'.format(rng.random()),
+                    'text': 'Posted by the bench command.',
+                    'tags': ' '.join(rng.sample(tags, min(3, len(tags)))),
+                }
+            yield method, path, data
+
+    def file_requests(self, filename, count):
+        with open(filename) as requests_file:
+            lines = [json.loads(line) for line in requests_file if line.strip()]
+        if not lines:
+            raise CommandError('{} has no requests'.format(filename))
+        for i in range(count):
+            line = lines[i % len(lines)]
+            yield line.get('method', 'GET').upper(), line['path'], line.get('data')
+
+    def endpoint(self, method, path):
+        try:
+            return '{} {}'.format(method, resolve(path.split('?')[0]).url_name)
+        except Resolver404:
+            return '{} {}'.format(method, path)
+
+    def bench_user(self):
+        user, created = User.objects.get_or_create(username='bench', defaults={'first_name': 'bench'})
+        if created:
+            Author.objects.create(user=user, name='bench')
+        return user
+
+    def bench_client(self, requests):
+        anonymous, logged_in = Client(), Client()
+        logged_in.force_login(self.bench_user())
+        # Connections opened from now on, the pool threads of async views included, are
+        # instrumented by app.metrics; this one may predate the import.
+        instrument_connection(sender=None, connection=connection)
+
+        results = []
+        for method, path, data in requests:
+            client = logged_in if method != 'GET' or self.authenticated else anonymous
+            stats = RequestStats()
+            token = current_stats.set(stats)
+            try:
+                start = time.perf_counter()
+                response = client.post(path, data) if method == 'POST' else client.get(path)
+                elapsed = time.perf_counter() - start
+            finally:
+                current_stats.reset(token)
+            results.append((self.endpoint(method, path), response.status_code, elapsed, stats.queries,
+                            stats.query_seconds))
+        return results
+
+    def url_session(self, opener, base_url):
+        """
+        Cookies of a session of the bench user, stored where the server reads sessions, with
+        the CSRF token the server hands out for it; the same login the test client forces.
+        """
+        user = self.bench_user()
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        session[SESSION_KEY] = user._meta.pk.value_to_string(user)
+        session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.save()
+
+        cookies = SimpleCookie({settings.SESSION_COOKIE_NAME: session.session_key})
+        request = Request(base_url + '/ask/', headers={
+            'Cookie': '{}={}'.format(settings.SESSION_COOKIE_NAME, session.session_key),
+        })
+        try:
+            with opener.open(request) as response:
+                response.read()
+                for header in response.headers.get_all('Set-Cookie') or []:
+                    cookies.load(header)
+        except HTTPError:
+            # Sent to the login page: the server does not know the session.
+            pass
+        if settings.CSRF_COOKIE_NAME not in cookies:
+            raise CommandError('{} did not log the bench user in, is it using this database?'.format(base_url))
+        return {key: morsel.value for key, morsel in cookies.items()}
+
+    def bench_url(self, requests, base_url, concurrency):
+        base_url = base_url.rstrip('/')
+        # Redirects are reported as such, as in client mode, instead of timing the page after them.
+        opener = build_opener(NoRedirect)
+        session = self.url_session(opener, base_url)
+        cookie = '; '.join('{}={}'.format(key, value) for key, value in session.items())
+
+        def send(request):
+            method, path, data = request
+            headers, body = {}, None
+            if method != 'GET' or self.authenticated:
+                headers['Cookie'] = cookie
+            if method == 'POST':
+                headers['X-CSRFToken'] = session[settings.CSRF_COOKIE_NAME]
+                body = urlencode(data or {}).encode()
+            start = time.perf_counter()
+            try:
+                with opener.open(Request(base_url + path, body, headers, method=method)) as response:
+                    response.read()
+                    status = response.status
+            except HTTPError as e:
+                status = e.code
+            return self.endpoint(method, path), status, time.perf_counter() - start, None, None
+
+        with ThreadPoolExecutor(concurrency) as executor:
+            return list(executor.map(send, requests))
+
+    def report(self, results, wall):
+        by_endpoint = defaultdict(list)
+        for result in results:
+            by_endpoint[result[0]].append(result)
+
+        endpoints = {}
+        for name, rows in sorted(by_endpoint.items()):
+            latencies = [row[2] * 1000 for row in rows]
+            statuses = defaultdict(int)
+            for row in rows:
+                statuses[str(row[1])] += 1
+            entry = {
+                'requests': len(rows),
+                'throughput_rps': round(len(rows) / wall, 2) if wall else None,
+                'p50_ms': round(percentile(latencies, 0.50), 2),
+                'p95_ms': round(percentile(latencies, 0.95), 2),
+                'p99_ms': round(percentile(latencies, 0.99), 2),
+                'status': dict(statuses),
+            }
+            if rows[0][3] is not None:
+                entry['sql_queries'] = round(sum(row[3] for row in rows) / len(rows), 2)
+                entry['sql_ms'] = round(sum(row[4] for row in rows) / len(rows) * 1000, 2)
+            endpoints[name] = entry
+
+        return {
+            'requests': len(results),
+            'wall_seconds': round(wall, 3),
+            'throughput_rps': round(len(results) / wall, 2) if wall else None,
+            'endpoints': endpoints,
+        }
+
+    def handle(self, *args, **options):
+        if options['db_size']:
+            call_command('renderData', db_size=options['db_size'], seed=options['seed'], stdout=self.stderr)
+
+        if options['clear_cache']:
+            cache.clear()
+
+        self.authenticated = options['authenticated']
+        rng = Random(options['seed'])
+        if options['requests']:
+            requests = list(self.file_requests(options['requests'], options['count']))
+        else:
+            requests = list(self.profile_requests(options['count'], rng))
+
+        start = time.perf_counter()
+        if options['url']:
+            results = self.bench_url(requests, options['url'], options['concurrency'])
+        else:
+            results = self.bench_client(requests)
+        report = self.report(results, time.perf_counter() - start)
+
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                output_file.write(output + '\n')
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,51 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from app.models import Question, Author, Tag, TagFeed, Answer
+
+SQLITE_FULL_SCAN = re.compile(r'\bSCAN (?:TABLE )?(?!TABLE )\w+\b(?! USING)')
+SQLITE_SORT = re.compile(r'USE TEMP B-TREE FOR ORDER BY')
+POSTGRES_FULL_SCAN = re.compile(r'\bSeq Scan\b')
+POSTGRES_SORT = re.compile(r'\bSort\b')
+
+
+class Command(BaseCommand):
+    help = 'Explain every manager query and fail on a full table scan followed by a sort'
+
+    def queries(self):
+        question = Question.objects.order_by('id').values('id', 'author__user_id').first()
+        tag = Tag.objects.order_by('-count').values_list('id', flat=True).first()
+        if question is None or tag is None:
+            raise CommandError('Database is empty, fill it with renderData first')
+
+        return [
+            ('Question.new', Question.objects.new()[:10]),
+            ('Question.hot', Question.objects.hot()[:10]),
+            ('TagFeed.new', TagFeed.objects.new(tag)[:10]),
+            ('TagFeed.hot', TagFeed.objects.hot(tag)[:10]),
+            ('Question.author', Question.objects.author(question['author__user_id'])[:10]),
+            ('Question.one_question', Question.objects.one_question(question['id'])),
+            ('Answer.answers', Answer.objects.answers(question['id'])[:3]),
+            ('Tag.popular_tags', Tag.objects.popular_tags()),
+            ('Author.popular_users', Author.objects.popular_users()),
+        ]
+
+    def is_bad_plan(self, plan):
+        if connection.vendor == 'postgresql':
+            return bool(POSTGRES_FULL_SCAN.search(plan) and POSTGRES_SORT.search(plan))
+        return bool(SQLITE_FULL_SCAN.search(plan) and SQLITE_SORT.search(plan))
+
+    def handle(self, *args, **options):
+        failed = []
+        for name, queryset in self.queries():
+            plan = queryset.explain()
+            bad = self.is_bad_plan(plan)
+            if bad:
+                failed.append(name)
+            self.stdout.write('{} {}'.format('FAIL' if bad else 'OK  ', name))
+            if options['verbosity'] > 1 or bad:
+                self.stdout.write(plan)
+
+        if failed:
+            raise CommandError('Full scan with sort in: {}'.format(', '.join(failed)))
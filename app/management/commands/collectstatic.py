@@ -0,0 +1,12 @@
+from django.contrib.staticfiles.management.commands import collectstatic
+from app.assets import build_bundles
+
+
+class Command(collectstatic.Command):
+    help = 'Build the STATIC_BUNDLES, then collect, hash and compress the static files into STATIC_ROOT'
+
+    def handle(self, **options):
+        bundles = build_bundles()
+        if options['verbosity'] >= 1:
+            self.stdout.write('Built {}'.format(', '.join(bundles)))
+        return super().handle(**options)
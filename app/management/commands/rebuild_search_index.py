@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from app import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index over questions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch_size', type=int, default=5000, help='Questions indexed per statement')
+
+    def handle(self, *args, **options):
+        search.create_index()
+        indexed = search.rebuild_index(options['batch_size'])
+        self.stdout.write('Indexed {} questions'.format(indexed))
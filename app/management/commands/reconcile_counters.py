@@ -0,0 +1,77 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Max, Value, When
+from django.db.models.functions import Now
+from app.jobs import pending_counts
+from app.models import Question, Author, Tag, TagFeed, Answer
+
+
+class Command(BaseCommand):
+    help = 'Recompute denormalized counters from their source tables and fix the rows that drifted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report the drift')
+        parser.add_argument('--chunk_size', type=int, default=10000, help='Rows compared per query')
+
+    def counters(self):
+        return [
+            (Tag, 'count', Tag.objects.expected_count),
+            (Author, 'count', Author.objects.expected_count),
+            (Question, 'answers_count', Question.objects.expected_answers_count),
+            (Question, 'rating', Question.objects.expected_rating),
+            (TagFeed, 'rating', TagFeed.objects.expected_rating),
+            (Answer, 'rating', Answer.objects.expected_rating),
+        ]
+
+    def reconcile(self, model, field, expected, chunk_size, dry_run):
+        last_id = model.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+        rows = drift = 0
+        for start in range(0, last_id, chunk_size):
+            with transaction.atomic():
+                drifted, target = self.compare(model, field, expected, start, start + chunk_size)
+                if not drifted:
+                    continue
+                rows += len(drifted)
+                drift += sum(abs(stored - value) for _, stored, value in drifted)
+                if self.verbosity > 1:
+                    for pk, stored, value in drifted:
+                        self.stdout.write('  {} {}: {} -> {}'.format(model.__name__, pk, stored, value))
+                if not dry_run:
+                    # Recomputed in the UPDATE itself, so writes since the comparison are not lost.
+                    updates = {field: target}
+                    if model is Question:
+                        updates['version'] = F('version') + 1
+                        updates['active_at'] = Now()
+                    model.objects.filter(id__in=[pk for pk, _, _ in drifted]).update(**updates)
+        return rows, drift
+
+    def compare(self, model, field, expected, start, end):
+        """
+        The rows of (start, end] whose field is not what it should be, and that value as an expression.
+        Counter jobs still queued (app/jobs.py) will add their deltas, which the source tables already
+        show, so they are taken off; locked, so a worker cannot apply them before this transaction ends.
+        """
+        pending = {pk: delta for pk, delta in pending_counts(model, field, lock=True).items() if start < pk <= end}
+        target = expected()
+        if pending:
+            target = target - Case(*(When(id=pk, then=Value(delta)) for pk, delta in pending.items()),
+                                   default=Value(0), output_field=IntegerField())
+        drifted = list(
+            model.objects.filter(id__gt=start, id__lte=end)
+            .annotate(expected=target)
+            .exclude(**{field: F('expected')})
+            .values_list('id', field, 'expected')
+        )
+        return drifted, target
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        total = 0
+        for model, field, expected in self.counters():
+            rows, drift = self.reconcile(model, field, expected, options['chunk_size'], options['dry_run'])
+            total += rows
+            self.stdout.write('{}.{}: {} rows drifted, total drift {}{}'.format(
+                model.__name__, field, rows, drift, '' if options['dry_run'] or not rows else ', fixed'
+            ))
+        if options['dry_run'] and total:
+            self.stdout.write('Dry run, nothing changed')
@@ -1,16 +1,90 @@
 from django.core.management.base import BaseCommand
-from app.models import Question, Author, Tag, Answer, LikeAnswer, LikeQuestion
+from app.models import Question, Author, Tag, TagFeed, Answer, LikeAnswer, LikeQuestion
+from app.cache import invalidate_popular_members, invalidate_popular_tags
+from app.search import rebuild_index
 from django.contrib.auth.models import User
-from random import randint, choice, choices
-from itertools import islice
+from django.db import transaction
+from django.db.models import Max, Min, Count
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from random import Random, SystemRandom
 from faker import Faker
-
-f = Faker()
+from faker.providers.lorem.en_US import Provider as LoremProvider
 
 small = [100, 100, 1000, 10000, 10000, 10000]
 medium = [1000, 1000, 10000, 100000, 100000, 1000000]
 large = [10000, 10000, 100000, 1000000, 1000000, 10000000]
 
+BATCH_SIZE = 5000
+TAG_WORDS = sorted(set(LoremProvider.word_list))
+REACTIONS = [True, True, False, True, False, True, False, True, True, True]
+
+f = None
+pools = {}
+
+
+class IdPool:
+    """Ids of existing rows to pick foreign keys from: a range when contiguous, else a compact array."""
+
+    def __init__(self, queryset):
+        bounds = queryset.aggregate(low=Min('id'), high=Max('id'), cnt=Count('id'))
+        self.low, self.high = bounds['low'] or 0, bounds['high'] or 0
+        self.ids = None
+        if bounds['cnt'] != self.high - self.low + 1:
+            self.ids = array('q', queryset.order_by('id').values_list('id', flat=True).iterator())
+
+    def __bool__(self):
+        return self.high > 0
+
+    def pick(self, rng):
+        if self.ids is not None:
+            return self.ids[rng.randrange(len(self.ids))]
+        return rng.randint(self.low, self.high)
+
+
+def init_worker(worker_pools):
+    global f, pools
+    f = Faker()
+    pools = worker_pools
+
+
+def generate(task):
+    """Rows of one batch, depending only on the task so any number of workers yields the same data."""
+    kind, seed, start, size = task
+    rng = Random('{}:{}:{}'.format(seed, kind, start))
+    f.seed_instance(rng.random())
+
+    if kind == 'users':
+        return [('{}{}'.format(f.first_name().lower(), start + i), f.email(), f.name()) for i in range(size)]
+    if kind == 'tags':
+        words = list(TAG_WORDS)
+        Random(seed).shuffle(words)
+        return [
+            words[i % len(words)] + (str(i // len(words)) if i >= len(words) else '')
+            for i in range(start, start + size)
+        ]
+    if kind == 'questions':
+        tags = pools['tags']
+        return [
+            (
+                pools['authors'].pick(rng),
+                f.sentence()[:128],
+                '. '.join(f.sentences(f.random_int(min=3, max=20))),
+                sorted({tags.pick(rng) for _ in range(rng.randint(0, 10))}) if tags else [],
+            )
+            for _ in range(size)
+        ]
+    if kind == 'answers':
+        return [
+            (pools['questions'].pick(rng), pools['authors'].pick(rng), '. '.join(f.sentences(f.random_int(min=2, max=5))))
+            for _ in range(size)
+        ]
+    if kind in ('likes_questions', 'likes_answers'):
+        targets = pools['questions' if kind == 'likes_questions' else 'answers']
+        return [(pools['authors'].pick(rng), targets.pick(rng), rng.choice(REACTIONS)) for _ in range(size)]
+    raise ValueError(kind)
+
 
 class Command(BaseCommand):
     help = 'Filling data with random values'
@@ -23,172 +97,104 @@ class Command(BaseCommand):
         parser.add_argument('--answers', type=int, help='Answers size')
         parser.add_argument('--likes_questions', type=int, help='Questions likes size')
         parser.add_argument('--likes_answers', type=int, help='Answers likes size')
-
-    def create(self, Obj, objs):
-        slice_size = 500
-        while True:
-            slices = list(islice(objs, slice_size))
-            if not slices:
-                break
-            Obj.objects.bulk_create(slices, slice_size)
+        parser.add_argument('--workers', type=int, default=1, help='Processes generating rows')
+        parser.add_argument('--seed', type=int, help='Seed for a reproducible dataset')
+
+    def batches(self, kind, cnt, offset=0):
+        """Generated batches in order, keeping at most two per worker in flight."""
+        tasks = ((kind, self.seed, offset + start, min(BATCH_SIZE, cnt - start)) for start in range(0, cnt, BATCH_SIZE))
+        if self.workers <= 1:
+            init_worker(self.pools)
+            yield from map(generate, tasks)
+            return
+
+        with ProcessPoolExecutor(self.workers, initializer=init_worker, initargs=(self.pools,)) as executor:
+            pending = deque()
+            for task in tasks:
+                pending.append(executor.submit(generate, task))
+                if len(pending) >= self.workers * 2:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def create(self, Obj, objs, ignore_conflicts=False):
+        Obj.objects.bulk_create(objs, 500, ignore_conflicts=ignore_conflicts)
+
+    def new_ids(self, Obj, last_id, cnt):
+        return list(Obj.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:cnt])
 
     def fill_authors(self, cnt):
         if cnt is None:
             return False
-        users = (
-            User(
-                username=f.unique.first_name(),
-                email=f.email()
-            )
-            for i in range(cnt)
-        )
-
-        self.create(User, users)
-        user_ids = list(User.objects.values_list('id', flat=True))
-        authors = (
-            Author(
-                user_id=user_ids[i],
-                name=f.name()
-            )
-            for i in range(cnt)
-        )
-        self.create(Author, authors)
+        offset = User.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+        for rows in self.batches('users', cnt, offset):
+            with transaction.atomic():
+                last_id = User.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+                self.create(User, [User(username=username, email=email) for username, email, _ in rows])
+                user_ids = self.new_ids(User, last_id, len(rows))
+                self.create(Author, [Author(user_id=user_id, name=row[2]) for user_id, row in zip(user_ids, rows)])
 
     def fill_tags(self, cnt):
         if cnt is None:
             return False
-        tags = (
-            Tag(
-                tag=f.unique.word()
-            )
-            for i in range(cnt)
-        )
-        self.create(Tag, tags)
+        for rows in self.batches('tags', cnt, Tag.objects.count()):
+            with transaction.atomic():
+                self.create(Tag, [Tag(tag=tag) for tag in rows], ignore_conflicts=True)
 
     def fill_questions(self, cnt):
-        author_ids = list(
-            Author.objects.values_list(
-                'id', flat=True
-            )
-        )
-        authors = choices(author_ids, k=cnt)
-        questions = (
-            Question(
-                author_id=authors[i],
-                text='. '.join(f.sentences(f.random_int(min=3, max=20))),
-                title=f.sentence()[:128],
-                date=f.date_time_this_month()
-            )
-            for i in range(cnt)
-        )
-        self.create(Question, questions)
-
-        tag_ids = list(Tag.objects.values_list('id', flat=True))
-        tags_count = dict.fromkeys(tag_ids, 0)
-
-        author_count = dict.fromkeys(author_ids, 0)
-        for question in Question.objects.all():
-            author_count[question.author.id] += 1
-            for tag in set(choices(tag_ids, k=randint(0, 10))):
-                tags_count[tag] += 1
-                question.tags.add(tag)
-
-        tags_list = list(Tag.objects.all())
-        authors_list = list(Author.objects.all())
-        for tag in tags_list:
-            tag.count = tags_count[tag.pk]
-        for author in authors_list:
-            author.count += author_count[author.pk]
-        Tag.objects.bulk_update(tags_list, ['count'])
-        Author.objects.bulk_update(authors_list, ['count'])
+        if cnt is None or not self.pools['authors']:
+            return False
+        QuestionTag = Question.tags.through
+        for rows in self.batches('questions', cnt):
+            with transaction.atomic():
+                last_id = Question.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+                self.create(Question, [Question(author_id=author_id, title=title, text=text)
+                                       for author_id, title, text, _ in rows])
+                question_ids = self.new_ids(Question, last_id, len(rows))
+                self.create(QuestionTag, [
+                    QuestionTag(question_id=question_id, tag_id=tag_id)
+                    for question_id, row in zip(question_ids, rows)
+                    for tag_id in row[3]
+                ])
+
+        Tag.objects.recount()
+        Author.objects.recount()
+        TagFeed.objects.rebuild()
 
     def fill_answers(self, cnt):
-        if cnt is None:
+        if cnt is None or not self.pools['questions']:
             return False
+        for rows in self.batches('answers', cnt):
+            with transaction.atomic():
+                self.create(Answer, [Answer(question_id=question_id, author_id=author_id, text=text)
+                                     for question_id, author_id, text in rows])
 
-        question_ids = list(Question.objects.values_list('id', flat=True))
-        author_ids = list(Author.objects.values_list('id', flat=True))
-        authors = choices(author_ids, k=cnt)
-        answers = (
-            Answer(
-                question_id=choice(question_ids),
-                author_id=authors[i],
-                text='. '.join(f.sentences(f.random_int(min=2, max=5))),
-            )
-            for i in range(cnt)
-        )
-        self.create(Answer, answers)
-
-        authors_count = dict.fromkeys(author_ids, 0)
-        for i in authors:
-            authors_count[i] += 1
-
-        authors_list = list(Author.objects.all())
-        for author in authors_list:
-            author.count += authors_count[author.pk]
-        Author.objects.bulk_update(authors_list, ['count'])
+        Question.objects.recount_answers()
+        Author.objects.recount()
 
     def fill_likes_questions(self, cnt):
-        if cnt is None:
+        if cnt is None or not self.pools['questions']:
             return False
-        author_ids = list(Author.objects.values_list('id', flat=True))
-        question_ids = list(Question.objects.values_list('id', flat=True))
-        questions = choices(question_ids, k=cnt)
-        reactions = choices([True, True, False, True, False, True, False, True, True, True], k=cnt)
-        likes = (
-            LikeQuestion(
-                author_id=choice(author_ids),
-                question_id=questions[i],
-                state=reactions[i]
-            )
-            for i in range(cnt)
-        )
-        self.create(LikeQuestion, likes)
-
-        questions_count = dict.fromkeys(question_ids, 0)
-        for i in range(cnt):
-            if reactions[i]:
-                questions_count[questions[i]] += 1
-            else:
-                questions_count[questions[i]] -= 1
-
-        questions_list = list(Question.objects.all())
-        for question in questions_list:
-            question.rating = questions_count[question.pk]
-        Question.objects.bulk_update(questions_list, ['rating'])
+        # Repeated (author, question) pairs are dropped by the unique constraint,
+        # so ratings are recounted from the stored reactions.
+        for rows in self.batches('likes_questions', cnt):
+            with transaction.atomic():
+                self.create(LikeQuestion, [LikeQuestion(author_id=author_id, question_id=question_id, state=state)
+                                           for author_id, question_id, state in rows], ignore_conflicts=True)
+        Question.objects.recount_rating()
+        TagFeed.objects.update(rating=TagFeed.objects.expected_rating())
 
     def fill_likes_answers(self, cnt):
-        if cnt is None:
+        if cnt is None or not self.pools['answers']:
             return False
-        author_ids = list(Author.objects.values_list('id', flat=True))
-        answer_ids = list(Answer.objects.values_list('id', flat=True))
-        answers = choices(answer_ids, k=cnt)
-        reactions = choices([True, True, False, True, False, True, False, False, True, True], k=cnt)
-        likes = (
-            LikeAnswer(
-                author_id=choice(author_ids),
-                answer_id=answers[i],
-                state=reactions[i]
-            )
-            for i in range(cnt)
-        )
-
-        self.create(LikeAnswer, likes)
-
-        answers_count = dict.fromkeys(answer_ids, 0)
-        for i in range(cnt):
-            if reactions[i]:
-                answers_count[answers[i]] += 1
-            else:
-                answers_count[answers[i]] -= 1
-
-        answers_list = list(Answer.objects.all())
-        for answer in answers_list:
-            answer.rating = answers_count[answer.pk]
-        Answer.objects.bulk_update(answers_list, ['rating'])
+        for rows in self.batches('likes_answers', cnt):
+            with transaction.atomic():
+                self.create(LikeAnswer, [LikeAnswer(author_id=author_id, answer_id=answer_id, state=state)
+                                         for author_id, answer_id, state in rows], ignore_conflicts=True)
+        Answer.objects.recount_rating()
 
     def handle(self, *args, **options):
-        data_size = [options.get('authors'),
+        data_size = [options.get('users'),
                      options.get('tags'),
                      options.get('questions'),
                      options.get('answers'),
@@ -202,9 +208,23 @@ class Command(BaseCommand):
         elif options.get('db_size') == 'large':
             data_size = large
 
+        self.workers = options['workers']
+        self.seed = options['seed'] if options['seed'] is not None else SystemRandom().randrange(2 ** 32)
+        self.stdout.write('Seed: {}'.format(self.seed))
+        self.pools = {}
+
         self.fill_authors(data_size[0])
         self.fill_tags(data_size[1])
+        self.pools['authors'] = IdPool(Author.objects.all())
+        self.pools['tags'] = IdPool(Tag.objects.all())
         self.fill_questions(data_size[2])
+        self.pools['questions'] = IdPool(Question.objects.all())
         self.fill_answers(data_size[3])
+        self.pools['answers'] = IdPool(Answer.objects.all())
         self.fill_likes_questions(data_size[4])
         self.fill_likes_answers(data_size[5])
+        Question.objects.rescore()
+        rebuild_index()
+
+        invalidate_popular_tags()
+        invalidate_popular_members()
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from app.models import Question, Watermark
+
+LAST_RUN = 'rescore_hot_questions'
+
+
+class Command(BaseCommand):
+    help = 'Recompute hot_score of the questions voted or answered since the previous run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Rescore every question')
+        parser.add_argument('--batch_size', type=int, default=1000, help='Questions updated per query')
+        parser.add_argument('--interval', type=int, help='Keep running, rescoring every this many seconds')
+
+    def rescore(self, rescore_all, batch_size):
+        # Taken before reading, so activity during the run is picked up by the next one.
+        started = timezone.now()
+        since = None
+        if not rescore_all:
+            since = Watermark.objects.filter(name=LAST_RUN).values_list('value', flat=True).first()
+        changed = Question.objects.rescore(since, batch_size)
+        Watermark.objects.update_or_create(name=LAST_RUN, defaults={'value': started})
+        self.stdout.write('Rescored {} questions {}'.format(
+            changed, 'in total' if since is None else 'active since {}'.format(since.isoformat())))
+
+    def handle(self, *args, **options):
+        self.rescore(options['all'], options['batch_size'])
+        while options['interval']:
+            time.sleep(options['interval'])
+            self.rescore(False, options['batch_size'])
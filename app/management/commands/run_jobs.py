@@ -0,0 +1,33 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from app.jobs import run_jobs, worker_name
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs (counters, search indexing, avatars) outside the web processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Drain the due jobs and exit')
+        parser.add_argument('--batch_size', type=int, default=settings.JOBS_BATCH_SIZE, help='Jobs claimed at a time')
+        parser.add_argument('--interval', type=int, default=settings.JOBS_POLL_INTERVAL,
+                            help='Seconds to wait when the queue is empty')
+
+    def drain(self, worker, batch_size):
+        done = 0
+        while True:
+            claimed = run_jobs(worker, batch_size)
+            if not claimed:
+                return done
+            done += claimed
+
+    def handle(self, *args, **options):
+        worker = worker_name()
+        while True:
+            done = self.drain(worker, options['batch_size'])
+            if done:
+                self.stdout.write('Ran {} jobs'.format(done))
+            if options['once']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,27 @@
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from app.routers import REPLICA
+
+
+class Command(BaseCommand):
+    help = 'Copy the SQLite primary into the SQLite replica, standing in for replication in local setups'
+
+    def handle(self, *args, **options):
+        databases = settings.DATABASES
+        if REPLICA not in databases:
+            raise CommandError('No replica configured, set REPLICA_DATABASE_URL')
+        primary, replica = databases[DEFAULT_DB_ALIAS], databases[REPLICA]
+        if not all(db['ENGINE'] == 'django.db.backends.sqlite3' for db in (primary, replica)):
+            raise CommandError('Only SQLite databases can be copied, use the database replication otherwise')
+
+        source = sqlite3.connect(str(primary['NAME']))
+        target = sqlite3.connect(str(replica['NAME']))
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+        self.stdout.write('Copied {} to {}'.format(primary['NAME'], replica['NAME']))
@@ -0,0 +1,258 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.template.backends.django import DjangoTemplates, Template
+from django.utils.decorators import sync_and_async_middleware
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+COUNTERS = [
+    ('askme_requests_total', 'counter', 'Requests served'),
+    ('askme_db_queries_total', 'counter', 'SQL queries issued'),
+    ('askme_db_query_seconds_total', 'counter', 'Time spent in SQL'),
+    ('askme_template_render_seconds_total', 'counter', 'Time spent rendering templates'),
+    ('askme_response_bytes_total', 'counter', 'Response body bytes'),
+]
+HISTOGRAM = ('askme_request_duration_seconds', 'Request latency')
+
+
+class Registry:
+    """
+    Per-process metrics, added into a SQLite file shared by all gunicorn workers every
+    METRICS_FLUSH_INTERVAL seconds by a background thread, so a request only ever touches
+    an in-memory dict.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = defaultdict(float)
+        self.flusher = None
+
+    def observe(self, view, seconds, queries, query_seconds, render_seconds, size):
+        with self.lock:
+            values = self.values
+            values[('askme_requests_total', view, '')] += 1
+            values[('askme_db_queries_total', view, '')] += queries
+            values[('askme_db_query_seconds_total', view, '')] += query_seconds
+            values[('askme_template_render_seconds_total', view, '')] += render_seconds
+            values[('askme_response_bytes_total', view, '')] += size
+            for le in BUCKETS:
+                if seconds <= le:
+                    values[(HISTOGRAM[0] + '_bucket', view, str(le))] += 1
+            values[(HISTOGRAM[0] + '_bucket', view, '+Inf')] += 1
+            values[(HISTOGRAM[0] + '_sum', view, '')] += seconds
+            values[(HISTOGRAM[0] + '_count', view, '')] += 1
+            if self.flusher is None and settings.METRICS_FLUSH_INTERVAL:
+                self.flusher = Flusher(self)
+                self.flusher.start()
+
+    def connect(self):
+        db = sqlite3.connect(str(settings.METRICS_DB), timeout=5)
+        db.execute(
+            'CREATE TABLE IF NOT EXISTS metrics ('
+            '    name TEXT, view TEXT, le TEXT, value REAL,'
+            '    PRIMARY KEY (name, view, le)'
+            ')'
+        )
+        return db
+
+    def flush(self):
+        with self.lock:
+            values, self.values = self.values, defaultdict(float)
+        if not values:
+            return
+        db = self.connect()
+        try:
+            with db:
+                db.executemany(
+                    'INSERT INTO metrics (name, view, le, value) VALUES (?, ?, ?, ?) '
+                    'ON CONFLICT (name, view, le) DO UPDATE SET value = value + excluded.value',
+                    [key + (value,) for key, value in values.items()]
+                )
+        except sqlite3.Error:
+            # Keep the numbers for the next flush rather than losing them on a busy file.
+            with self.lock:
+                for key, value in values.items():
+                    self.values[key] += value
+        finally:
+            db.close()
+
+    def collect(self):
+        self.flush()
+        db = self.connect()
+        try:
+            return db.execute('SELECT name, view, le, value FROM metrics ORDER BY name, view').fetchall()
+        finally:
+            db.close()
+
+
+class Flusher(threading.Thread):
+    """Flushes a registry every METRICS_FLUSH_INTERVAL seconds, off the request path."""
+
+    def __init__(self, registry):
+        super().__init__(name='askme-metrics', daemon=True)
+        self.registry = registry
+
+    def run(self):
+        while True:
+            time.sleep(settings.METRICS_FLUSH_INTERVAL)
+            try:
+                self.registry.flush()
+            except Exception:
+                logger.exception('Flushing metrics failed')
+
+
+registry = Registry()
+render_state = threading.local()
+
+
+def bucket_order(row):
+    le = row[2]
+    return row[0], row[1], float('inf') if le == '+Inf' else float(le or 0)
+
+
+def prometheus_text():
+    rows = sorted(registry.collect(), key=bucket_order)
+    by_name = defaultdict(list)
+    for name, view, le, value in rows:
+        by_name[name].append((view, le, value))
+
+    lines = []
+    for name, kind, help_text in COUNTERS:
+        lines.append('# HELP {} {}'.format(name, help_text))
+        lines.append('# TYPE {} {}'.format(name, kind))
+        for view, _, value in by_name[name]:
+            lines.append('{}{{view="{}"}} {}'.format(name, view, repr(value)))
+
+    name, help_text = HISTOGRAM
+    lines.append('# HELP {} {}'.format(name, help_text))
+    lines.append('# TYPE {} histogram'.format(name))
+    for suffix in ('_bucket', '_sum', '_count'):
+        for view, le, value in by_name[name + suffix]:
+            labels = 'view="{}",le="{}"'.format(view, le) if le else 'view="{}"'.format(view)
+            lines.append('{}{}{{{}}} {}'.format(name, suffix, labels, repr(value)))
+    return '\n'.join(lines) + '\n'
+
+
+class RequestStats:
+    """SQL and template time of one request, shared with the pool threads its async view runs on."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.render_seconds = 0.0
+
+    def add_query(self, seconds):
+        with self.lock:
+            self.queries += 1
+            self.query_seconds += seconds
+
+    def add_render(self, seconds):
+        with self.lock:
+            self.render_seconds += seconds
+
+    def add(self, other):
+        with self.lock:
+            self.queries += other.queries
+            self.query_seconds += other.query_seconds
+            self.render_seconds += other.render_seconds
+
+
+# Copied into the threads of sync_to_async, so queries made there count for the request.
+current_stats = ContextVar('current_stats', default=None)
+
+
+def finish_request(token, stats):
+    """Restore the stats around the request and add this request's to them (the bench command sets some)."""
+    current_stats.reset(token)
+    outer = current_stats.get()
+    if outer is not None:
+        outer.add(stats)
+
+
+def time_query(execute, sql, params, many, context):
+    stats = current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.add_query(time.perf_counter() - start)
+
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        depth = getattr(render_state, 'depth', 0)
+        render_state.depth = depth + 1
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            render_state.depth = depth
+            stats = current_stats.get()
+            if depth == 0 and stats is not None:
+                stats.add_render(time.perf_counter() - start)
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """Django template backend that adds the time of top-level renders to the current request."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        template = super().get_template(template_name)
+        return TimedTemplate(template.template, self)
+
+
+def observe(request, response, stats, start):
+    match = request.resolver_match
+    view = match.url_name or match.view_name if match else 'unresolved'
+    size = 0 if response.streaming else len(response.content)
+    registry.observe(view, time.perf_counter() - start, stats.queries, stats.query_seconds, stats.render_seconds, size)
+
+
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            stats = RequestStats()
+            token = current_stats.set(stats)
+            start = time.perf_counter()
+            try:
+                response = await get_response(request)
+            finally:
+                finish_request(token, stats)
+            observe(request, response, stats, start)
+            return response
+    else:
+        def middleware(request):
+            stats = RequestStats()
+            token = current_stats.set(stats)
+            start = time.perf_counter()
+            try:
+                response = get_response(request)
+            finally:
+                finish_request(token, stats)
+            observe(request, response, stats, start)
+            return response
+
+    return middleware
@@ -0,0 +1,28 @@
+# Generated by Django 3.1.2 on 2026-10-18 19:23
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_answers_count(apps, schema_editor):
+    Question = apps.get_model('app', 'Question')
+    Answer = apps.get_model('app', 'Answer')
+    answers = Answer.objects.filter(question_id=OuterRef('pk')).order_by().values('question_id')
+    Question.objects.update(answers_count=Coalesce(Subquery(answers.annotate(cnt=Count('id')).values('cnt')), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='answers_count',
+            field=models.IntegerField(default=0, verbose_name='Количество ответов'),
+        ),
+        migrations.RunPython(backfill_answers_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 3.1.2 on 2026-10-18 19:25
+
+from django.db import migrations, models
+from django.db.models import Case, IntegerField, Min, OuterRef, Subquery, Sum, When
+from django.db.models.functions import Coalesce
+
+
+def drop_duplicate_reactions(apps, schema_editor):
+    reaction_value = Case(When(state=True, then=1), When(state=False, then=-1), default=0, output_field=IntegerField())
+    for like_name, target_name in (('LikeQuestion', 'Question'), ('LikeAnswer', 'Answer')):
+        Like = apps.get_model('app', like_name)
+        Target = apps.get_model('app', target_name)
+        target = target_name.lower()
+
+        first = Like.objects.values('author_id', target + '_id').annotate(first_id=Min('id')).values('first_id')
+        if not Like.objects.exclude(id__in=Subquery(first)).delete()[0]:
+            continue
+
+        likes = Like.objects.filter(**{target + '_id': OuterRef('pk')}).order_by().values(target + '_id')
+        Target.objects.update(rating=Coalesce(Subquery(likes.annotate(total=Sum(reaction_value)).values('total')), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0002_question_answers_count'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='answer',
+            index=models.Index(fields=['question', 'rating'], name='answer_question_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='author',
+            index=models.Index(fields=['count'], name='author_count_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['date', 'id'], name='question_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['rating', 'id'], name='question_rating_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['author', 'rating', 'id'], name='question_author_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(fields=['count'], name='tag_count_idx'),
+        ),
+        migrations.RunPython(drop_duplicate_reactions, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='likeanswer',
+            constraint=models.UniqueConstraint(fields=('author', 'answer'), name='unique_answer_reaction'),
+        ),
+        migrations.AddConstraint(
+            model_name='likequestion',
+            constraint=models.UniqueConstraint(fields=('author', 'question'), name='unique_question_reaction'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+from django.db import migrations
+
+# The search table as of this migration; app/search.py keeps it up to date afterwards.
+SEARCH_TABLE = 'app_question_search'
+
+SQLITE_CREATE = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING fts5(title, text, tags, "
+    "tokenize = 'unicode61 remove_diacritics 2')",
+    'INSERT INTO {table} (rowid, title, text, tags) '
+    'SELECT q.id, q.title, q.text, ('
+    "    SELECT group_concat(t.tag, ' ') FROM app_question_tags qt "
+    '    JOIN app_tag t ON t.id = qt.tag_id WHERE qt.question_id = q.id'
+    ') FROM app_question q',
+]
+
+POSTGRES_CREATE = [
+    'CREATE TABLE IF NOT EXISTS {table} ('
+    '    question_id integer PRIMARY KEY REFERENCES app_question (id) ON DELETE CASCADE,'
+    '    document tsvector NOT NULL'
+    ')',
+    'CREATE INDEX IF NOT EXISTS {table}_document_idx ON {table} USING GIN (document)',
+    'INSERT INTO {table} (question_id, document) '
+    'SELECT q.id, '
+    "    setweight(to_tsvector('simple', q.title), 'A') || "
+    "    setweight(to_tsvector('simple', coalesce(("
+    "        SELECT string_agg(t.tag, ' ') FROM app_question_tags qt "
+    "        JOIN app_tag t ON t.id = qt.tag_id WHERE qt.question_id = q.id"
+    "    ), '')), 'B') || "
+    "    setweight(to_tsvector('simple', q.text), 'C') "
+    'FROM app_question q',
+]
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    statements = POSTGRES_CREATE if connection.vendor == 'postgresql' else SQLITE_CREATE
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement.format(table=SEARCH_TABLE))
+
+
+def drop_search_index(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('DROP TABLE IF EXISTS {}'.format(SEARCH_TABLE))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0003_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.2 on 2026-10-18 19:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_question_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='version',
+            field=models.IntegerField(default=0, verbose_name='Версия карточки'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 3.1.2 on 2026-10-18 19:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_tag_feeds(apps, schema_editor):
+    schema_editor.execute(
+        'INSERT INTO app_tagfeed (tag_id, question_id, date, rating) '
+        'SELECT qt.tag_id, q.id, q.date, q.rating FROM app_question_tags qt '
+        'JOIN app_question q ON q.id = qt.question_id'
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_question_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagFeed',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateTimeField(verbose_name='Дата публикации')),
+                ('rating', models.IntegerField(default=0, verbose_name='Рейтинг')),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='app.question', verbose_name='Вопрос')),
+                ('tag', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='app.tag', verbose_name='Тег')),
+            ],
+            options={
+                'verbose_name': 'Вопрос в ленте тега',
+                'verbose_name_plural': 'Ленты тегов',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='tagfeed',
+            index=models.Index(fields=['tag', 'date', 'id'], name='tag_feed_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tagfeed',
+            index=models.Index(fields=['tag', 'rating', 'id'], name='tag_feed_rating_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='tagfeed',
+            constraint=models.UniqueConstraint(fields=('tag', 'question'), name='unique_tag_feed_question'),
+        ),
+        migrations.RunPython(fill_tag_feeds, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 3.1.2 on 2026-10-18 19:39
+
+import math
+from datetime import datetime
+
+from django.db import migrations, models
+from django.db.models import F
+import django.utils.timezone
+
+# The formula as of this migration, kept here so later changes to app.models.hot_score do not alter it.
+HOT_EPOCH = datetime(2020, 1, 1, tzinfo=django.utils.timezone.utc)
+HOT_DECAY = 45000
+ANSWER_WEIGHT = 2
+
+
+def hot_score(rating, answers_count, date):
+    activity = rating + ANSWER_WEIGHT * answers_count
+    sign = (activity > 0) - (activity < 0)
+    return round(sign * math.log10(max(abs(activity), 1)) + (date - HOT_EPOCH).total_seconds() / HOT_DECAY, 7)
+
+
+def fill_hot_scores(apps, schema_editor):
+    Question = apps.get_model('app', 'Question')
+    db_alias = schema_editor.connection.alias
+    Question.objects.using(db_alias).update(active_at=F('date'))
+    questions = Question.objects.using(db_alias).only('id', 'rating', 'answers_count', 'date').order_by('id')
+    last_id = 0
+    while True:
+        batch = list(questions.filter(id__gt=last_id)[:1000])
+        if not batch:
+            return
+        last_id = batch[-1].id
+        for question in batch:
+            question.hot_score = hot_score(question.rating, question.answers_count, question.date)
+        Question.objects.using(db_alias).bulk_update(batch, ['hot_score'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_tag_feed'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='question',
+            name='question_rating_id_idx',
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='active_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Последняя активность'),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='hot_score',
+            field=models.FloatField(default=0, verbose_name='Горячесть'),
+        ),
+        migrations.RunPython(fill_hot_scores, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['hot_score', 'id'], name='question_hot_score_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['active_at'], name='question_active_at_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 3.1.2 on 2026-10-18 19:53
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_question_hot_score'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=32, verbose_name='Тип')),
+                ('payload', models.JSONField(default=dict, verbose_name='Данные')),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Не раньше')),
+                ('attempts', models.IntegerField(default=0, verbose_name='Попытки')),
+                ('claimed_by', models.CharField(blank=True, max_length=64, null=True, verbose_name='Обработчик')),
+                ('claimed_until', models.DateTimeField(blank=True, null=True, verbose_name='Занята до')),
+                ('failed_at', models.DateTimeField(blank=True, null=True, verbose_name='Время отказа')),
+                ('last_error', models.TextField(blank=True, verbose_name='Последняя ошибка')),
+            ],
+            options={
+                'verbose_name': 'Фоновая задача',
+                'verbose_name_plural': 'Фоновые задачи',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['run_after', 'id'], name='job_run_after_idx'),
+        ),
+    ]
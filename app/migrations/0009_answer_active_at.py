@@ -0,0 +1,30 @@
+# Generated by Django 3.1.2 on 2026-10-18 20:16
+
+from django.db import migrations, models
+from django.db.models import F
+import django.utils.timezone
+
+
+def fill_active_at(apps, schema_editor):
+    Answer = apps.get_model('app', 'Answer')
+    Answer.objects.using(schema_editor.connection.alias).update(active_at=F('date'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0008_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='answer',
+            name='active_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Последняя активность'),
+        ),
+        migrations.RunPython(fill_active_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='answer',
+            index=models.Index(fields=['question', 'active_at'], name='answer_question_active_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.1.2 on 2026-10-18 20:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0009_answer_active_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Watermark',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64, unique=True, verbose_name='Название')),
+                ('value', models.DateTimeField(verbose_name='Значение')),
+            ],
+            options={
+                'verbose_name': 'Отметка выполнения',
+                'verbose_name_plural': 'Отметки выполнения',
+            },
+        ),
+    ]
@@ -1,7 +1,40 @@
-from django.db import models
+import math
+from datetime import datetime, timedelta
+
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import Case, Count, F, IntegerField, OuterRef, Subquery, Sum, When
+from django.db.models.functions import Coalesce, Now
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.urls import reverse
+from django.utils import timezone
 from django.contrib.auth.models import User
 
 
+REACTION_VALUE = Case(When(state=True, then=1), When(state=False, then=-1), default=0, output_field=IntegerField())
+
+HOT_EPOCH = datetime(2020, 1, 1, tzinfo=timezone.utc)
+# Seconds of age that cost as much as a tenfold difference in activity
+HOT_DECAY = 45000
+ANSWER_WEIGHT = 2
+
+
+def hot_score(rating, answers_count, date):
+    """
+    Log of the activity plus the age of the question from a fixed epoch: newer questions
+    start higher, so a stored score never goes stale by itself, only when the activity changes.
+    """
+    activity = rating + ANSWER_WEIGHT * answers_count
+    sign = (activity > 0) - (activity < 0)
+    return round(sign * math.log10(max(abs(activity), 1)) + (date - HOT_EPOCH).total_seconds() / HOT_DECAY, 7)
+
+
+def correlated(queryset, key, aggregate):
+    """Aggregate over the rows of queryset whose key points at the outer row, 0 when there are none."""
+    rows = queryset.filter(**{key: OuterRef('pk')}).order_by().values(key)
+    return Coalesce(Subquery(rows.annotate(value=aggregate).values('value')), 0)
+
+
 def upload_avatar(instance, filename):
     return 'avatars/{}/{}'.format(instance.user.id, filename)
 
@@ -10,6 +43,12 @@ class AuthorManager(models.Manager):
     def popular_users(self):
         return self.order_by('-count')[:5]
 
+    def expected_count(self):
+        return correlated(Question.objects, 'author_id', Count('id')) + correlated(Answer.objects, 'author_id', Count('id'))
+
+    def recount(self):
+        return self.update(count=self.expected_count())
+
 
 class Author(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, verbose_name='ID зарегистрированного пользователя')
@@ -25,12 +64,30 @@ class Author(models.Model):
     class Meta:
         verbose_name = 'Автор'
         verbose_name_plural = 'Авторы'
+        indexes = [
+            models.Index(fields=['count'], name='author_count_idx'),
+        ]
 
 
 class TagManager(models.Manager):
     def popular_tags(self):
         return self.order_by('-count')[:10]
 
+    def expected_count(self):
+        return correlated(Question.tags.through.objects, 'tag_id', Count('id'))
+
+    def recount(self):
+        return self.update(count=self.expected_count())
+
+    def upsert(self, names):
+        """Ids of the named tags in order, creating the missing ones even if another request inserts them too."""
+        ids = dict(self.filter(tag__in=names).values_list('tag', 'id'))
+        missing = [name for name in names if name not in ids]
+        if missing:
+            self.bulk_create([self.model(tag=name) for name in missing], ignore_conflicts=True)
+            ids.update(self.filter(tag__in=missing).values_list('tag', 'id'))
+        return [ids[name] for name in names]
+
 
 class Tag(models.Model):
     tag = models.CharField(max_length=25, unique=True, verbose_name='Тег')
@@ -44,24 +101,62 @@ class Tag(models.Model):
     class Meta:
         verbose_name = 'Тег'
         verbose_name_plural = 'Теги'
+        indexes = [
+            models.Index(fields=['count'], name='tag_count_idx'),
+        ]
 
 
 class QuestionManager(models.Manager):
     def new(self):
-        return self.order_by('-date')
+        return self.order_by('-date', '-id')
 
     def hot(self):
-        return self.order_by('-rating')
+        return self.order_by('-hot_score', '-id')
 
     def tag(self, tag):
-        return self.filter(tags__tag=tag)
+        return self.filter(tags__tag=tag).order_by('-date', '-id')
 
     def author(self, author_id):
-        return self.filter(author__user_id=author_id).order_by('-rating')
+        return self.filter(author__user_id=author_id).order_by('-rating', '-id')
 
     def one_question(self, pk):
         return self.filter(id=pk)
 
+    def detail(self, pk):
+        """The question page row with its author; tags are prefetched by the card cache on a miss."""
+        return self.one_question(pk).select_related('author').first()
+
+    def expected_answers_count(self):
+        return correlated(Answer.objects, 'question_id', Count('id'))
+
+    def expected_rating(self):
+        return correlated(LikeQuestion.objects, 'question_id', Sum(REACTION_VALUE))
+
+    def recount_answers(self):
+        return self.update(answers_count=self.expected_answers_count())
+
+    def recount_rating(self):
+        return self.update(rating=self.expected_rating())
+
+    def rescore(self, since=None, batch_size=1000):
+        """Recompute hot_score of the questions active since the given time, or of all of them; returns rows changed."""
+        questions = self.all() if since is None else self.filter(active_at__gte=since)
+        questions = questions.only('id', 'rating', 'answers_count', 'date', 'hot_score').order_by('id')
+        last_id = changed = 0
+        while True:
+            batch = list(questions.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                return changed
+            last_id = batch[-1].id
+            stale = []
+            for question in batch:
+                score = hot_score(question.rating, question.answers_count, question.date)
+                if score != question.hot_score:
+                    question.hot_score = score
+                    stale.append(question)
+            self.bulk_update(stale, ['hot_score'])
+            changed += len(stale)
+
 
 class Question(models.Model):
     title = models.CharField(max_length=1024, verbose_name='Заголовок')
@@ -70,14 +165,22 @@ class Question(models.Model):
     author = models.ForeignKey(Author, on_delete=models.CASCADE)
     tags = models.ManyToManyField(Tag, blank=True, verbose_name='Теги')
     rating = models.IntegerField(default=0, verbose_name='Рейтинг')
+    answers_count = models.IntegerField(default=0, verbose_name='Количество ответов')
+    version = models.IntegerField(default=0, verbose_name='Версия карточки')
+    hot_score = models.FloatField(default=0, verbose_name='Горячесть')
+    active_at = models.DateTimeField(default=timezone.now, verbose_name='Последняя активность')
 
     objects = QuestionManager()
 
     def __str__(self):
         return self.title
 
-    def answers_count(self):
-        return Answer.objects.answers_count(self.id)
+    def save(self, *args, **kwargs):
+        if self.pk is not None:
+            self.version += 1
+        else:
+            self.hot_score = hot_score(self.rating, self.answers_count, self.active_at)
+        super().save(*args, **kwargs)
 
     def all_tags(self):
         return self.tags.all()
@@ -85,15 +188,81 @@ class Question(models.Model):
     class Meta:
         verbose_name = 'Вопрос'
         verbose_name_plural = 'Вопросы'
+        indexes = [
+            models.Index(fields=['date', 'id'], name='question_date_id_idx'),
+            models.Index(fields=['hot_score', 'id'], name='question_hot_score_id_idx'),
+            models.Index(fields=['active_at'], name='question_active_at_idx'),
+            models.Index(fields=['author', 'rating', 'id'], name='question_author_rating_idx'),
+        ]
+
+
+class TagFeedManager(models.Manager):
+    def new(self, tag_id):
+        return self.filter(tag_id=tag_id).order_by('-date', '-id')
+
+    def hot(self, tag_id):
+        return self.filter(tag_id=tag_id).order_by('-rating', '-id')
+
+    def add(self, question_id, tag_ids):
+        question = Question.objects.filter(id=question_id).values('date', 'rating').get()
+        self.bulk_create([self.model(tag_id=tag_id, question_id=question_id, **question) for tag_id in tag_ids],
+                         ignore_conflicts=True)
+
+    def expected_rating(self):
+        return Subquery(Question.objects.filter(id=OuterRef('question_id')).values('rating'))
+
+    def rebuild(self):
+        """Refill every feed from the tags through table in one INSERT ... SELECT."""
+        self.all().delete()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO {feed} (tag_id, question_id, date, rating) '
+                'SELECT qt.tag_id, q.id, q.date, q.rating FROM {through} qt '
+                'JOIN {question} q ON q.id = qt.question_id'.format(
+                    feed=self.model._meta.db_table,
+                    through=Question.tags.through._meta.db_table,
+                    question=Question._meta.db_table,
+                )
+            )
+
+
+class TagFeed(models.Model):
+    """Per-tag copy of the sort keys of its questions, so a tag page is an index seek on one table."""
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, db_index=False, verbose_name='Тег')
+    question = models.ForeignKey(Question, on_delete=models.CASCADE, verbose_name='Вопрос')
+    date = models.DateTimeField(verbose_name='Дата публикации')
+    rating = models.IntegerField(default=0, verbose_name='Рейтинг')
+
+    objects = TagFeedManager()
+
+    class Meta:
+        verbose_name = 'Вопрос в ленте тега'
+        verbose_name_plural = 'Ленты тегов'
+        constraints = [
+            models.UniqueConstraint(fields=['tag', 'question'], name='unique_tag_feed_question'),
+        ]
+        indexes = [
+            models.Index(fields=['tag', 'date', 'id'], name='tag_feed_date_idx'),
+            models.Index(fields=['tag', 'rating', 'id'], name='tag_feed_rating_idx'),
+        ]
 
 
 class AnswerManager(models.Manager):
     def answers(self, question_id):
         return self.filter(question__id=question_id).order_by('-rating')
 
+    def page(self, question_id):
+        return self.answers(question_id).select_related('author')
+
     def answers_count(self, question_id):
         return self.filter(question__id=question_id).count()
 
+    def expected_rating(self):
+        return correlated(LikeAnswer.objects, 'answer_id', Sum(REACTION_VALUE))
+
+    def recount_rating(self):
+        return self.update(rating=self.expected_rating())
+
 
 class Answer(models.Model):
     question = models.ForeignKey(Question, on_delete=models.CASCADE, verbose_name='Вопрос')
@@ -102,6 +271,7 @@ class Answer(models.Model):
     date = models.DateTimeField(auto_now_add=True, verbose_name='Дата публикации')
     rating = models.IntegerField(default=0, verbose_name='Рейтинг')
     is_correct = models.BooleanField(default=False, verbose_name='Корректность ответа')
+    active_at = models.DateTimeField(default=timezone.now, verbose_name='Последняя активность')
 
     objects = AnswerManager()
 
@@ -111,6 +281,70 @@ class Answer(models.Model):
     class Meta:
         verbose_name = 'Ответ'
         verbose_name_plural = 'Ответы'
+        indexes = [
+            models.Index(fields=['question', 'rating'], name='answer_question_rating_idx'),
+            models.Index(fields=['question', 'active_at'], name='answer_question_active_idx'),
+        ]
+
+
+class ReactionManager(models.Manager):
+    target = None
+
+    def vote(self, author_id, target_id, state):
+        """
+        Like (state=True) or dislike (state=False) the target. Repeating a vote takes it back,
+        the opposite one flips it. Returns the new reaction state and the target rating.
+        """
+        value = 1 if state else -1
+        target_model = self.model._meta.get_field(self.target).related_model
+        lookup = {'author_id': author_id, self.target + '_id': target_id}
+
+        with transaction.atomic():
+            for _ in range(3):
+                try:
+                    with transaction.atomic():
+                        self.create(state=state, **lookup)
+                    delta, current = value, state
+                    break
+                except IntegrityError:
+                    pass
+                # Every branch is a conditional write, so concurrent votes never act on a stale read.
+                if self.filter(state=state, **lookup).delete()[0]:
+                    delta, current = -value, None
+                    break
+                if self.filter(state=not state, **lookup).update(state=state):
+                    delta, current = 2 * value, state
+                    break
+                if self.filter(state__isnull=True, **lookup).update(state=state):
+                    delta, current = value, state
+                    break
+            else:
+                raise IntegrityError('Reaction of author {} changed concurrently'.format(author_id))
+
+            self.apply_delta(target_model, target_id, delta)
+            rating = target_model.objects.filter(id=target_id).values_list('rating', flat=True).get()
+
+        return current, rating
+
+    def apply_delta(self, target_model, target_id, delta):
+        target_model.objects.filter(id=target_id).update(rating=F('rating') + delta)
+
+
+class LikeQuestionManager(ReactionManager):
+    target = 'question'
+
+    def apply_delta(self, target_model, target_id, delta):
+        target_model.objects.filter(id=target_id).update(rating=F('rating') + delta, version=F('version') + 1,
+                                                         active_at=Now())
+        TagFeed.objects.filter(question_id=target_id).update(rating=F('rating') + delta)
+
+
+class LikeAnswerManager(ReactionManager):
+    target = 'answer'
+
+    def apply_delta(self, target_model, target_id, delta):
+        # active_at lets the live answer streams find the answers voted since their last poll.
+        target_model.objects.filter(id=target_id).update(rating=F('rating') + delta, active_at=Now())
 
 
 class LikeQuestion(models.Model):
@@ -118,12 +352,17 @@ class LikeQuestion(models.Model):
     question = models.ForeignKey(Question, on_delete=models.CASCADE, verbose_name='Вопрос')
     state = models.BooleanField(null=True, verbose_name='Какая реакция')
 
+    objects = LikeQuestionManager()
+
     def __str__(self):
         return 'Реакция на вопрос: {}'.format(self.question.title)
 
     class Meta:
         verbose_name = 'Реакция на вопрос'
         verbose_name_plural = 'Реакции на вопросы'
+        constraints = [
+            models.UniqueConstraint(fields=['author', 'question'], name='unique_question_reaction'),
+        ]
 
 
 class LikeAnswer(models.Model):
@@ -131,9 +370,132 @@ class LikeAnswer(models.Model):
     answer = models.ForeignKey(Answer, on_delete=models.CASCADE, verbose_name='Ответ')
     state = models.BooleanField(null=True, verbose_name='Какая реакция')
 
+    objects = LikeAnswerManager()
+
     def __str__(self):
         return 'Реакция на ответ к вопросу: {}'.format(self.answer.question.title)
 
     class Meta:
         verbose_name = 'Реакция на ответ'
         verbose_name_plural = 'Реакции на ответы'
+        constraints = [
+            models.UniqueConstraint(fields=['author', 'answer'], name='unique_answer_reaction'),
+        ]
+
+
+class JobManager(models.Manager):
+    def due(self):
+        return self.filter(failed_at=None, run_after__lte=timezone.now())
+
+    def claim(self, worker, batch_size, lease_seconds):
+        """
+        Jobs that are due and not leased by another worker, leased to this one for lease_seconds.
+        One UPDATE, so concurrent workers never get the same job.
+        """
+        now = timezone.now()
+        free = models.Q(claimed_until=None) | models.Q(claimed_until__lt=now)
+        ids = self.due().filter(free).order_by('id').values('id')[:batch_size]
+        self.filter(free, id__in=Subquery(ids)).update(
+            claimed_by=worker, claimed_until=now + timedelta(seconds=lease_seconds)
+        )
+        return list(self.filter(claimed_by=worker, claimed_until__gt=now).order_by('id'))
+
+    def retry(self, jobs, error, max_attempts, delay_seconds):
+        """Release the jobs with an exponential backoff, or mark them failed after max_attempts."""
+        now = timezone.now()
+        for job in jobs:
+            job.attempts += 1
+            job.last_error = error
+            job.claimed_by = job.claimed_until = None
+            if job.attempts >= max_attempts:
+                job.failed_at = now
+            else:
+                job.run_after = now + timedelta(seconds=delay_seconds * 2 ** (job.attempts - 1))
+        self.bulk_update(jobs, ['attempts', 'last_error', 'claimed_by', 'claimed_until', 'failed_at', 'run_after'])
+
+
+class Job(models.Model):
+    kind = models.CharField(max_length=32, verbose_name='Тип')
+    payload = models.JSONField(default=dict, verbose_name='Данные')
+    run_after = models.DateTimeField(default=timezone.now, verbose_name='Не раньше')
+    attempts = models.IntegerField(default=0, verbose_name='Попытки')
+    claimed_by = models.CharField(max_length=64, null=True, blank=True, verbose_name='Обработчик')
+    claimed_until = models.DateTimeField(null=True, blank=True, verbose_name='Занята до')
+    failed_at = models.DateTimeField(null=True, blank=True, verbose_name='Время отказа')
+    last_error = models.TextField(blank=True, verbose_name='Последняя ошибка')
+
+    objects = JobManager()
+
+    def __str__(self):
+        return '{} #{}'.format(self.kind, self.id)
+
+    class Meta:
+        verbose_name = 'Фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+        indexes = [
+            models.Index(fields=['run_after', 'id'], name='job_run_after_idx'),
+        ]
+
+
+class Watermark(models.Model):
+    """How far a periodic command got, kept in the database so an evicted cache entry cannot reset it."""
+    name = models.CharField(max_length=64, unique=True, verbose_name='Название')
+    value = models.DateTimeField(verbose_name='Значение')
+
+    def __str__(self):
+        return self.name
+
+    class Meta:
+        verbose_name = 'Отметка выполнения'
+        verbose_name_plural = 'Отметки выполнения'
+
+
+@receiver(post_delete, sender=Question)
+def question_deleted(sender, instance, **kwargs):
+    # The FTS5 table has no foreign key to cascade from.
+    from app.search import unindex_questions
+    unindex_questions([instance.id])
+
+
+@receiver(post_delete, sender=Answer)
+def answer_deleted(sender, instance, **kwargs):
+    Question.objects.filter(id=instance.question_id).update(answers_count=F('answers_count') - 1,
+                                                             version=F('version') + 1, active_at=Now())
+    from app.cache import purge_pages
+    transaction.on_commit(lambda: purge_pages(reverse('question', kwargs={'pk': instance.question_id})))
+
+
+@receiver(m2m_changed, sender=Question.tags.through)
+def question_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        question_ids = [instance.pk]
+        feeds = TagFeed.objects.filter(question_id=instance.pk)
+        if action == 'post_add':
+            TagFeed.objects.add(instance.pk, pk_set)
+        elif action == 'post_remove':
+            feeds.filter(tag_id__in=pk_set).delete()
+        else:
+            feeds.delete()
+    else:
+        question_ids = list(pk_set or [])
+        feeds = TagFeed.objects.filter(tag_id=instance.pk)
+        if action == 'post_add':
+            for question_id in question_ids:
+                TagFeed.objects.add(question_id, [instance.pk])
+        elif action == 'post_remove':
+            feeds.filter(question_id__in=question_ids).delete()
+        else:
+            feeds.delete()
+
+    Question.objects.filter(id__in=question_ids).update(version=F('version') + 1)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Author)
+def user_changed(sender, instance, **kwargs):
+    # Settings, avatar, password and last_login changes must not be served from the cached snapshot.
+    from app.cache import invalidate_user
+    invalidate_user(instance.id if sender is User else instance.user_id)
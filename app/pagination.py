@@ -0,0 +1,132 @@
+import base64
+import json
+
+from django.db import connections, router
+from django.db.models import Q
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(values):
+    raw = json.dumps(values, default=str, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        raise InvalidCursor(cursor)
+    if not isinstance(values, list):
+        raise InvalidCursor(cursor)
+    return values
+
+
+def estimate_count(model):
+    """Cheap row estimate for a whole table, never a full COUNT(*)."""
+    table = model._meta.db_table
+    connection = connections[router.db_for_read(model)]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE relname = %s', [table])
+        else:
+            cursor.execute('SELECT MAX(id) FROM {}'.format(connection.ops.quote_name(table)))
+        row = cursor.fetchone()
+    return max(row[0] or 0, 0) if row else 0
+
+
+class CursorPage:
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None, estimated_total=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.estimated_total = estimated_total
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """
+    Seek pagination over a queryset ordered by unique keys, e.g. ('-date', '-id').
+
+    Pages are fetched with a WHERE on the last seen keys instead of OFFSET, so
+    the cost of a page does not depend on how deep it is.
+    """
+
+    def __init__(self, queryset, per_page=10, ordering=None, estimate=None):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = tuple(ordering or queryset.query.order_by)
+        if not self.ordering or self.ordering[-1].lstrip('-') not in ('id', 'pk'):
+            raise ValueError('Cursor pagination needs an ordering ending with the primary key')
+        self.fields = [key.lstrip('-') for key in self.ordering]
+        self.estimate = estimate
+
+    def _key(self, obj):
+        if isinstance(obj, dict):
+            return [obj[field] for field in self.fields]
+        return [getattr(obj, field) for field in self.fields]
+
+    def _parse(self, cursor):
+        values = decode_cursor(cursor)
+        if len(values) != len(self.fields):
+            raise InvalidCursor(cursor)
+        model = self.queryset.model
+        try:
+            return [model._meta.get_field(field).to_python(value) for field, value in zip(self.fields, values)]
+        except Exception:
+            raise InvalidCursor(cursor)
+
+    def _seek(self, values, forward):
+        condition = Q()
+        for i in reversed(range(len(self.ordering))):
+            descending = self.ordering[i].startswith('-')
+            lookup = 'lt' if descending == forward else 'gt'
+            step = Q(**{'{}__{}'.format(self.fields[i], lookup): values[i]})
+            if condition:
+                step |= Q(**{self.fields[i]: values[i]}) & condition
+            condition = step
+        return condition
+
+    def _reversed_ordering(self):
+        return [key[1:] if key.startswith('-') else '-' + key for key in self.ordering]
+
+    def page(self, after=None, before=None):
+        queryset = self.queryset
+        if before:
+            rows = list(queryset.filter(self._seek(self._parse(before), False))
+                        .order_by(*self._reversed_ordering())[:self.per_page + 1])
+            has_previous = len(rows) > self.per_page
+            rows = rows[:self.per_page][::-1]
+            has_next = True
+        else:
+            if after:
+                queryset = queryset.filter(self._seek(self._parse(after), True))
+            rows = list(queryset.order_by(*self.ordering)[:self.per_page + 1])
+            has_next = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+            has_previous = bool(after)
+
+        next_cursor = encode_cursor(self._key(rows[-1])) if rows and has_next else None
+        previous_cursor = encode_cursor(self._key(rows[0])) if rows and has_previous else None
+        estimated_total = self.estimate() if self.estimate is not None else None
+        return CursorPage(rows, next_cursor, previous_cursor, estimated_total)
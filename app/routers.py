@@ -0,0 +1,107 @@
+import asyncio
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.utils.decorators import sync_and_async_middleware
+
+REPLICA = 'replica'
+PIN_COOKIE = 'use_primary'
+
+# Only requests let through by primary_pin_middleware read the replica; management commands,
+# shells and tests outside a request see the primary. Copied into the threads of sync_to_async.
+use_primary = ContextVar('use_primary', default=True)
+
+
+class ReplicaHealth:
+    """Whether the replica answers, rechecked at most every REPLICA_HEALTH_CHECK_INTERVAL seconds per process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.healthy = True
+        self.checked_at = None
+
+    def check(self):
+        connection = connections[REPLICA]
+        try:
+            connection.ensure_connection()
+            if connection.is_usable():
+                return True
+        except DatabaseError:
+            pass
+        # Do not keep a broken persistent connection around until CONN_MAX_AGE.
+        connection.close()
+        return False
+
+    def __call__(self):
+        now = time.monotonic()
+        with self.lock:
+            due = self.checked_at is None or now - self.checked_at >= settings.REPLICA_HEALTH_CHECK_INTERVAL
+            if due:
+                self.checked_at = now
+        if due:
+            self.healthy = self.check()
+        return self.healthy
+
+
+replica_health = ReplicaHealth()
+
+
+class ReplicaRouter:
+    """
+    Reads go to the replica, writes to the primary. A request is pinned to the primary when it
+    is not a GET/HEAD, or for REPLICA_PIN_SECONDS after one, so a redirect after a save reads
+    what was just written instead of a lagging copy.
+    """
+
+    def db_for_read(self, model, **hints):
+        if REPLICA not in settings.DATABASES or use_primary.get():
+            return DEFAULT_DB_ALIAS
+        # A transaction reads its own uncommitted writes (ATOMIC_REQUESTS, TestCase).
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block or not replica_health():
+            return DEFAULT_DB_ALIAS
+        return REPLICA
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+def pins_primary(request):
+    return request.method not in ('GET', 'HEAD') or PIN_COOKIE in request.COOKIES
+
+
+def set_pin(request, response):
+    if request.method not in ('GET', 'HEAD'):
+        response.set_cookie(PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS, httponly=True, samesite='Lax')
+    return response
+
+
+@sync_and_async_middleware
+def primary_pin_middleware(get_response):
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            token = use_primary.set(pins_primary(request))
+            try:
+                response = await get_response(request)
+            finally:
+                use_primary.reset(token)
+            return set_pin(request, response)
+    else:
+        def middleware(request):
+            token = use_primary.set(pins_primary(request))
+            try:
+                response = get_response(request)
+            finally:
+                use_primary.reset(token)
+            return set_pin(request, response)
+
+    return middleware
@@ -0,0 +1,184 @@
+import re
+
+from django.db import connection, connections, router
+from app.models import Question
+from app.pagination import CursorPage, InvalidCursor, decode_cursor, encode_cursor
+
+SEARCH_TABLE = 'app_question_search'
+WORD = re.compile(r'\w+', re.UNICODE)
+
+
+class SqliteSearchBackend:
+    """FTS5 virtual table keyed by question id; bm25 gives lower ranks to better matches."""
+
+    def create(self, cursor):
+        cursor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS {} USING fts5(title, text, tags, "
+            "tokenize = 'unicode61 remove_diacritics 2')".format(SEARCH_TABLE)
+        )
+
+    def drop(self, cursor):
+        cursor.execute('DROP TABLE IF EXISTS {}'.format(SEARCH_TABLE))
+
+    def index(self, cursor, ids):
+        self.unindex(cursor, ids)
+        placeholders = ', '.join(['%s'] * len(ids))
+        cursor.execute(
+            'INSERT INTO {} (rowid, title, text, tags) '
+            'SELECT q.id, q.title, q.text, ('
+            '    SELECT group_concat(t.tag, \' \') FROM app_question_tags qt '
+            '    JOIN app_tag t ON t.id = qt.tag_id WHERE qt.question_id = q.id'
+            ') FROM app_question q WHERE q.id IN ({})'.format(SEARCH_TABLE, placeholders),
+            ids
+        )
+
+    def unindex(self, cursor, ids):
+        placeholders = ', '.join(['%s'] * len(ids))
+        cursor.execute('DELETE FROM {} WHERE rowid IN ({})'.format(SEARCH_TABLE, placeholders), ids)
+
+    def match(self, query):
+        words = WORD.findall(query)
+        if not words:
+            return None
+        terms = ['"{}"'.format(word) for word in words]
+        terms[-1] += '*'
+        return ' '.join(terms)
+
+    def ranked(self):
+        return (
+            'SELECT rowid AS id, bm25({table}, 10.0, 1.0, 5.0) AS rank '
+            'FROM {table} WHERE {table} MATCH %s'.format(table=SEARCH_TABLE)
+        )
+
+
+class PostgresSearchBackend:
+    """tsvector side table with a GIN index; ranks are negated so lower is better here too."""
+
+    def create(self, cursor):
+        cursor.execute(
+            'CREATE TABLE IF NOT EXISTS {} ('
+            '    question_id integer PRIMARY KEY REFERENCES app_question (id) ON DELETE CASCADE,'
+            '    document tsvector NOT NULL'
+            ')'.format(SEARCH_TABLE)
+        )
+        cursor.execute(
+            'CREATE INDEX IF NOT EXISTS {table}_document_idx ON {table} USING GIN (document)'.format(table=SEARCH_TABLE)
+        )
+
+    def drop(self, cursor):
+        cursor.execute('DROP TABLE IF EXISTS {}'.format(SEARCH_TABLE))
+
+    def index(self, cursor, ids):
+        cursor.execute(
+            'INSERT INTO {} (question_id, document) '
+            'SELECT q.id, '
+            "    setweight(to_tsvector('simple', q.title), 'A') || "
+            "    setweight(to_tsvector('simple', coalesce(("
+            "        SELECT string_agg(t.tag, ' ') FROM app_question_tags qt "
+            "        JOIN app_tag t ON t.id = qt.tag_id WHERE qt.question_id = q.id"
+            "    ), '')), 'B') || "
+            "    setweight(to_tsvector('simple', q.text), 'C') "
+            'FROM app_question q WHERE q.id = ANY(%s) '
+            'ON CONFLICT (question_id) DO UPDATE SET document = EXCLUDED.document'.format(SEARCH_TABLE),
+            [list(ids)]
+        )
+
+    def unindex(self, cursor, ids):
+        # Rows of deleted questions are removed by ON DELETE CASCADE already.
+        pass
+
+    def match(self, query):
+        words = WORD.findall(query)
+        if not words:
+            return None
+        return ' & '.join(words[:-1] + [words[-1] + ':*'])
+
+    def ranked(self):
+        return (
+            "SELECT question_id AS id, -ts_rank(document, to_tsquery('simple', %s)) AS rank "
+            "FROM {table} WHERE document @@ to_tsquery('simple', %s)".format(table=SEARCH_TABLE)
+        )
+
+
+def get_backend():
+    if connection.vendor == 'postgresql':
+        return PostgresSearchBackend()
+    return SqliteSearchBackend()
+
+
+def create_index(apps=None, schema_editor=None):
+    with connection.cursor() as cursor:
+        get_backend().create(cursor)
+
+
+def drop_index(apps=None, schema_editor=None):
+    with connection.cursor() as cursor:
+        get_backend().drop(cursor)
+
+
+def index_questions(ids):
+    ids = list(ids)
+    if not ids:
+        return
+    with connection.cursor() as cursor:
+        get_backend().index(cursor, ids)
+
+
+def unindex_questions(ids):
+    ids = list(ids)
+    if not ids:
+        return
+    with connection.cursor() as cursor:
+        get_backend().unindex(cursor, ids)
+
+
+def rebuild_index(batch_size=5000):
+    last_id = 0
+    indexed = 0
+    while True:
+        ids = list(Question.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return indexed
+        index_questions(ids)
+        indexed += len(ids)
+        last_id = ids[-1]
+
+
+def search(query, per_page=10, after=None, before=None):
+    """Ranked question search paged by a (rank, id) cursor."""
+    backend = get_backend()
+    match = backend.match(query)
+    if match is None:
+        return CursorPage([])
+
+    ranked = backend.ranked()
+    params = [match] * ranked.count('%s')
+    cursor_value = after or before
+    where = ''
+    if cursor_value:
+        try:
+            rank, last_id = decode_cursor(cursor_value)
+            rank, last_id = float(rank), int(last_id)
+        except (InvalidCursor, TypeError, ValueError):
+            raise InvalidCursor(cursor_value)
+        where = 'WHERE rank {0} %s OR (rank = %s AND id {0} %s)'.format('>' if after else '<')
+        params += [rank, rank, last_id]
+    order = 'rank, id' if not before else 'rank DESC, id DESC'
+
+    with connections[router.db_for_read(Question)].cursor() as cursor:
+        cursor.execute(
+            'SELECT id, rank FROM ({}) ranked {} ORDER BY {} LIMIT %s'.format(ranked, where, order),
+            params + [per_page + 1]
+        )
+        rows = cursor.fetchall()
+
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if before:
+        rows.reverse()
+
+    questions = Question.objects.select_related('author').in_bulk([row[0] for row in rows])
+    object_list = [questions[row[0]] for row in rows if row[0] in questions]
+    next_cursor = encode_cursor([rows[-1][1], rows[-1][0]]) if rows and (has_more or before) else None
+    previous_cursor = encode_cursor([rows[0][1], rows[0][0]]) if rows and (has_more if before else after) else None
+    return CursorPage(object_list, next_cursor, previous_cursor)
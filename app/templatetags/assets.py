@@ -0,0 +1,25 @@
+from django import template
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.templatetags.static import static
+from django.utils.html import format_html, format_html_join
+
+register = template.Library()
+
+TAGS = {
+    '.css': '<link href="{}" rel="stylesheet">',
+    '.js': '<script src="{}"></script>',
+}
+
+
+@register.simple_tag
+def bundle(name):
+    """
+    One tag for a collected STATIC_BUNDLES entry, one per source file until collectstatic has
+    built it. DEBUG does not matter: a collected tree always serves the bundle.
+    """
+    tag = TAGS['.css' if name.endswith('.css') else '.js']
+    is_collected = getattr(staticfiles_storage, 'is_collected', None)
+    if is_collected and is_collected(name):
+        return format_html(tag, static(name))
+    return format_html_join('\n', tag, ((static(path),) for path in settings.STATIC_BUNDLES[name]))
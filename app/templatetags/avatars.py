@@ -0,0 +1,25 @@
+from django import template
+from django.core.files.storage import default_storage
+from django.utils.html import format_html
+from app.avatars import derivative_name, fit_size
+
+register = template.Library()
+
+
+@register.simple_tag
+def avatar(author, size, css_class=''):
+    """<picture> with WebP and JPEG derivatives at 1x and 2x of the displayed size."""
+    name = author.avatar.name
+    one, two = fit_size(size), fit_size(size * 2)
+
+    def srcset(ext):
+        if one == two:
+            return default_storage.url(derivative_name(name, one, ext))
+        return '{} 1x, {} 2x'.format(default_storage.url(derivative_name(name, one, ext)),
+                                     default_storage.url(derivative_name(name, two, ext)))
+
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}">'
+        '<img src="{}" srcset="{}" width="{}" height="{}" alt="" class="{}"/></picture>',
+        srcset('webp'), default_storage.url(derivative_name(name, one, 'jpg')), srcset('jpg'), size, size, css_class,
+    )
@@ -0,0 +1,23 @@
+from django import template
+
+register = template.Library()
+
+
+def page_url(request, param, cursor):
+    query = request.GET.copy()
+    query.pop('after', None)
+    query.pop('before', None)
+    if cursor is not None:
+        query[param] = cursor
+    return '?' + query.urlencode() if query else request.path
+
+
+@register.inclusion_tag('inc/cursor_paginator.html', takes_context=True)
+def cursor_paginate(context, page):
+    request = context['request']
+    return {
+        'page': page,
+        'first_url': page_url(request, None, None),
+        'previous_url': page_url(request, 'before', page.previous_cursor) if page.has_previous() else None,
+        'next_url': page_url(request, 'after', page.next_cursor) if page.has_next() else None,
+    }
@@ -0,0 +1,10 @@
+from django import template
+from django.utils.safestring import mark_safe
+from app.cache import render_question_cards
+
+register = template.Library()
+
+
+@register.simple_tag
+def question_cards(questions, style):
+    return mark_safe(''.join(render_question_cards(questions, style)))
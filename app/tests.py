@@ -1,3 +1,672 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import json
+import pickle
+import random
+import re
+import shutil
+import tempfile
+import threading
+from datetime import timedelta
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from PIL import Image
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from app.avatars import DEFAULT_AVATAR, FORMATS, SIZES, derivative_name
+from app.cache import page_generation_key, user_key
+from app.forms import AskQuestion
+from app.jobs import HANDLERS, bump, handler, run_jobs
+from app.live import LiveApplication, changes_since, publish_rating
+from app.pagination import CursorPaginator, InvalidCursor, decode_cursor, encode_cursor, estimate_count
+from app.routers import PIN_COOKIE, ReplicaHealth
+from app.search import SEARCH_TABLE, index_questions, search
+from app.models import Answer, Author, Job, Question, LikeAnswer, LikeQuestion, Tag, TagFeed, Watermark, hot_score
+
+
+def make_author(username):
+    user = User.objects.create_user(username=username, password='password', first_name=username)
+    return Author.objects.create(user=user, name=username)
+
+
+class Isolated:
+    """
+    Runs the tests against a local-memory cache and a throwaway metrics file, never the cache
+    directory and metrics.sqlite3 of the checkout; the cache starts empty for every test. No
+    metrics flusher thread is started, it could outlive the override.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        metrics_dir = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, metrics_dir)
+        isolated = override_settings(
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+            METRICS_DB=Path(metrics_dir) / 'metrics.sqlite3',
+            METRICS_FLUSH_INTERVAL=0,
+        )
+        isolated.enable()
+        cls.addClassCleanup(isolated.disable)
+        super().setUpClass()
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+
+class IsolatedTestCase(Isolated, TestCase):
+    pass
+
+
+class IsolatedTransactionTestCase(Isolated, TransactionTestCase):
+    pass
+
+
+class VoteTests(IsolatedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = make_author('voter')
+        self.question = Question.objects.create(title='Title', text='Text', author=self.author)
+        self.client.login(username='voter', password='password')
+        self.url = reverse('vote_question', kwargs={'pk': self.question.id})
+
+    def test_like_toggle_and_flip(self):
+        response = self.client.post(self.url, {'state': 'like'})
+        self.assertEqual(response.json(), {'rating': 1, 'state': 'like'})
+
+        response = self.client.post(self.url, {'state': 'like'})
+        self.assertEqual(response.json(), {'rating': 0, 'state': None})
+
+        self.client.post(self.url, {'state': 'like'})
+        response = self.client.post(self.url, {'state': 'dislike'})
+        self.assertEqual(response.json(), {'rating': -1, 'state': 'dislike'})
+        self.assertEqual(LikeQuestion.objects.get().state, False)
+
+    def test_anonymous_vote_is_rejected(self):
+        # Logged-out pages have no CSRF token, the vote still has to get the 401 the script handles.
+        client = Client(enforce_csrf_checks=True)
+        response = client.post(self.url, {'state': 'like'})
+        self.assertEqual(response.status_code, 401)
+
+    def test_user_without_author_gets_one_on_first_use(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+
+        self.assertEqual(self.client.get(reverse('new')).status_code, 200)
+        response = self.client.post(self.url, {'state': 'like'})
+        self.assertEqual(response.json(), {'rating': 1, 'state': 'like'})
+        self.assertEqual(LikeQuestion.objects.get().author, Author.objects.get(user__username='admin'))
+
+    def test_vote_without_csrf_token_is_forbidden(self):
+        client = Client(enforce_csrf_checks=True)
+        client.login(username='voter', password='password')
+        response = client.post(self.url, {'state': 'like'})
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(LikeQuestion.objects.exists())
+
+
+class QuestionPageQueryTests(IsolatedTestCase):
+    # question with author, answer page with authors, card tags, popular tags, popular members
+    cold_queries = 5
+    # question with author, answer page with authors
+    warm_queries = 2
+
+    def setUp(self):
+        super().setUp()
+        authors = [make_author('answerer{}'.format(i)) for i in range(5)]
+        self.question = Question.objects.create(title='Title', text='Text', author=authors[0])
+        self.question.tags.add(Tag.objects.create(tag='python'), Tag.objects.create(tag='django'))
+        Answer.objects.bulk_create([
+            Answer(question=self.question, author=authors[i % 5], text='Answer {}'.format(i)) for i in range(10)
+        ])
+        Question.objects.recount_answers()
+        self.url = reverse('question', kwargs={'pk': self.question.id})
+
+    def test_query_budget(self):
+        with self.assertNumQueries(self.cold_queries):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['comments']), 3)
+
+        with self.assertNumQueries(self.warm_queries):
+            response = self.client.get(self.url + '?page=2')
+        self.assertEqual(response.context['comments'].number, 2)
+
+    def test_last_page_from_answers_count(self):
+        with self.assertNumQueries(self.cold_queries):
+            response = self.client.get(self.url + '?page=last')
+        self.assertEqual(response.context['comments'].number, 4)
+        self.assertEqual(len(response.context['comments']), 1)
+
+    def test_evicted_page_generation_does_not_serve_stale_page(self):
+        self.client.get(self.url)
+        Question.objects.filter(id=self.question.id).update(title='Edited')
+        cache.delete(page_generation_key(self.url))
+
+        self.assertContains(self.client.get(self.url), 'Edited')
+
+    def test_logged_in_page_view_costs_no_auth_queries(self):
+        self.client.login(username='answerer1', password='password')
+        self.client.get(self.url)
+
+        with self.assertNumQueries(self.warm_queries):
+            response = self.client.get(self.url + '?page=2')
+        self.assertEqual(response.context['request'].user.author.name, 'answerer1')
+
+    def test_settings_change_is_not_served_from_the_cached_user(self):
+        self.client.login(username='answerer1', password='password')
+        self.client.get(self.url)
+        self.client.post(reverse('settings'), {'username': 'answerer1', 'first_name': 'Renamed', 'email': ''})
+
+        response = self.client.get(self.url + '?page=2')
+        self.assertEqual(response.context['request'].user.first_name, 'Renamed')
+
+    def test_cached_user_holds_no_password_hash(self):
+        user = User.objects.get(username='answerer1')
+        self.client.login(username='answerer1', password='password')
+        self.client.get(self.url)
+        self.assertNotIn(user.password.encode(), pickle.dumps(cache.get(user_key(user.id))))
+
+        # Saving the snapshot leaves the password it does not hold alone.
+        self.client.post(reverse('settings'), {'username': 'answerer1', 'first_name': 'Renamed', 'email': ''})
+        self.client.logout()
+        self.assertTrue(self.client.login(username='answerer1', password='password'))
+
+        user.set_password('changed')
+        user.save()
+        response = self.client.get(self.url + '?page=2')
+        self.assertFalse(response.context['request'].user.is_authenticated)
+
+    def test_missing_question_past_the_end_shows_the_last_one(self):
+        response = self.client.get(reverse('question', kwargs={'pk': self.question.id + 100}))
+        self.assertEqual(response.context['question'], self.question)
+
+
+class AskQuestionTests(IsolatedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = make_author('asker')
+        Tag.objects.create(tag='python')
+
+    def ask(self, tags):
+        form = AskQuestion(self.author, data={'title': 'Title', 'text': 'Text', 'tags': tags})
+        self.assertTrue(form.is_valid(), form.errors)
+        with CaptureQueriesContext(connection) as queries:
+            question = form.save()
+        return question, len(queries)
+
+    def test_tags_are_normalized_and_counted(self):
+        question, _ = self.ask('Python  django python DJANGO orm')
+        run_jobs('test')
+
+        self.assertEqual(sorted(question.tags.values_list('tag', flat=True)), ['django', 'orm', 'python'])
+        self.assertEqual(dict(Tag.objects.values_list('tag', 'count')), {'python': 1, 'django': 1, 'orm': 1})
+        self.assertEqual(TagFeed.objects.filter(question=question).count(), 3)
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.count, 1)
+
+    def test_reconcile_leaves_queued_counter_bumps_alone(self):
+        self.ask('python django')
+        out = StringIO()
+        call_command('reconcile_counters', stdout=out)
+        self.assertIn('Tag.count: 0 rows drifted', out.getvalue())
+        self.assertIn('Author.count: 0 rows drifted', out.getvalue())
+
+        run_jobs('test')
+        self.assertEqual(dict(Tag.objects.values_list('tag', 'count')), {'python': 1, 'django': 1})
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.count, 1)
+
+    def test_query_count_does_not_depend_on_tag_count(self):
+        _, few = self.ask('python one')
+        _, many = self.ask('python two three four five six seven eight')
+        self.assertEqual(few, many)
+
+
+class PaginationTests(IsolatedTestCase):
+    def setUp(self):
+        super().setUp()
+        author = make_author('pager')
+        self.questions = [
+            Question.objects.create(title='Question {}'.format(i), text='Text', author=author) for i in range(7)
+        ]
+        # Three scores for seven questions: most pages start or end inside a tie.
+        for i, question in enumerate(self.questions):
+            Question.objects.filter(id=question.id).update(hot_score=i % 3)
+
+    def walk(self, paginator):
+        pages, page = [], paginator.page()
+        while True:
+            pages.append(list(page))
+            if page.next_cursor is None:
+                return pages, page
+            page = paginator.page(after=page.next_cursor)
+
+    def test_after_and_before_cursors_round_trip(self):
+        paginator = CursorPaginator(Question.objects.hot(), per_page=3)
+        pages, last = self.walk(paginator)
+
+        self.assertEqual([len(items) for items in pages], [3, 3, 1])
+        self.assertEqual(sum(pages, []), list(Question.objects.hot()))
+        self.assertEqual(list(paginator.page(before=last.previous_cursor)), pages[1])
+        first = paginator.page(before=paginator.page(before=last.previous_cursor).previous_cursor)
+        self.assertEqual(list(first), pages[0])
+
+    def test_hot_score_ties_are_broken_by_id(self):
+        pages, _ = self.walk(CursorPaginator(Question.objects.hot(), per_page=2))
+        keys = [(question.hot_score, question.id) for question in sum(pages, [])]
+        self.assertEqual(keys, sorted(keys, reverse=True))
+        self.assertEqual(len(set(keys)), len(self.questions))
+
+    def test_invalid_cursor(self):
+        for cursor in ('garbage', encode_cursor({'id': 1}), encode_cursor([1])):
+            with self.subTest(cursor), self.assertRaises(InvalidCursor):
+                CursorPaginator(Question.objects.hot()).page(after=cursor)
+        self.assertEqual(decode_cursor(encode_cursor([1.5, 'x'])), [1.5, 'x'])
+
+        response = self.client.get(reverse('api_hot'), {'after': 'garbage'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': 'invalid cursor'})
+
+    def test_ordering_must_end_with_the_primary_key(self):
+        with self.assertRaises(ValueError):
+            CursorPaginator(Question.objects.order_by('-hot_score'))
+
+    def test_estimate_count(self):
+        self.assertGreaterEqual(estimate_count(Question), len(self.questions))
+        Question.objects.all().delete()
+        self.assertEqual(estimate_count(Question), 0)
+
+
+class SearchTests(IsolatedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = make_author('seeker')
+
+    def indexed_rows(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT count(*) FROM {}'.format(SEARCH_TABLE))
+            return cursor.fetchone()[0]
+
+    def test_asked_question_is_found_once_indexed(self):
+        form = AskQuestion(self.author, data={'title': 'Sorting dictionaries', 'text': 'By value', 'tags': 'python'})
+        self.assertTrue(form.is_valid(), form.errors)
+        question = form.save()
+        self.assertEqual(list(search('dictionaries')), [])
+
+        run_jobs('test')
+        self.assertEqual(list(search('dictionaries')), [question])
+        self.assertEqual(list(search('pyth')), [question])
+        self.assertEqual(list(search('lists')), [])
+
+    def test_rank_cursor_pages_through_every_match(self):
+        questions = [
+            Question.objects.create(title='Cursor ' * (i % 3 + 1), text='Pagination {}'.format(i), author=self.author)
+            for i in range(7)
+        ]
+        index_questions([question.id for question in questions])
+        everything = list(search('cursor', per_page=10))
+        self.assertEqual(sorted(everything, key=lambda question: question.id), questions)
+
+        pages, page = [], search('cursor', per_page=3)
+        while True:
+            pages.append(list(page))
+            if page.next_cursor is None:
+                break
+            page = search('cursor', per_page=3, after=page.next_cursor)
+        self.assertEqual([len(items) for items in pages], [3, 3, 1])
+        self.assertEqual(sum(pages, []), everything)
+
+        self.assertEqual(list(search('cursor', per_page=3, before=page.previous_cursor)), pages[1])
+        with self.assertRaises(InvalidCursor):
+            search('cursor', after='garbage')
+
+    def test_deleted_question_leaves_the_index(self):
+        question = Question.objects.create(title='Short lived', text='Text', author=self.author)
+        index_questions([question.id])
+        self.assertEqual(self.indexed_rows(), 1)
+
+        question.delete()
+        self.assertEqual(self.indexed_rows(), 0)
+        self.assertEqual(list(search('short')), [])
+
+
+class RescoreTests(IsolatedTestCase):
+    def test_incremental_run_only_rescores_questions_active_since_the_last(self):
+        author = make_author('scorer')
+        idle, active = [
+            Question.objects.create(title=title, text='Text', author=author) for title in ('Idle', 'Active')
+        ]
+        call_command('rescore_hot_questions', stdout=StringIO())
+        last_run = Watermark.objects.get(name='rescore_hot_questions').value
+
+        Question.objects.filter(id=idle.id).update(rating=10, active_at=last_run - timedelta(seconds=1))
+        Question.objects.filter(id=active.id).update(rating=10, active_at=last_run + timedelta(seconds=1))
+        # The watermark is not in the cache, losing it changes nothing.
+        cache.clear()
+        out = StringIO()
+        call_command('rescore_hot_questions', stdout=out)
+
+        self.assertIn('Rescored 1 questions active since', out.getvalue())
+        idle.refresh_from_db()
+        active.refresh_from_db()
+        self.assertNotEqual(idle.hot_score, hot_score(10, 0, idle.date))
+        self.assertEqual(active.hot_score, hot_score(10, 0, active.date))
+        self.assertGreater(Watermark.objects.get(name='rescore_hot_questions').value, last_run)
+
+
+class JobTests(IsolatedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = make_author('worker')
+
+    def test_counter_bumps_are_coalesced(self):
+        for _ in range(3):
+            bump(Author, 'count', {self.author.id: 1})
+        bump(Author, 'count', {self.author.id: -1})
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(run_jobs('test'), 4)
+        updates = [query for query in queries if query['sql'].startswith('UPDATE "app_author"')]
+        self.assertEqual(len(updates), 1)
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.count, 2)
+        self.assertFalse(Job.objects.exists())
+
+    def test_failed_job_is_retried_without_holding_back_the_batch(self):
+        @handler('test_fail')
+        def fail(payloads):
+            if any(payload.get('bad') for payload in payloads):
+                raise ValueError('bad payload')
+        self.addCleanup(HANDLERS.pop, 'test_fail')
+
+        Job.objects.bulk_create([Job(kind='test_fail', payload={'bad': False}),
+                                 Job(kind='test_fail', payload={'bad': True})])
+        with self.assertLogs('app.jobs', 'ERROR'):
+            run_jobs('test')
+
+        job = Job.objects.get()
+        self.assertEqual(job.payload, {'bad': True})
+        self.assertEqual(job.attempts, 1)
+        self.assertIn('bad payload', job.last_error)
+        self.assertEqual(run_jobs('test'), 0)
+
+
+class AvatarTests(IsolatedTestCase):
+    def setUp(self):
+        super().setUp()
+        # Uploads would otherwise land in the tracked uploads/ directory.
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.author = make_author('pictured')
+        self.client.login(username='pictured', password='password')
+
+    def test_uploaded_avatar_is_switched_by_the_job(self):
+        buffer = BytesIO()
+        Image.new('RGB', (300, 240), 'teal').save(buffer, 'PNG')
+        data = buffer.getvalue()
+        self.client.post(reverse('settings'), {
+            'username': 'pictured', 'first_name': 'pictured', 'email': '',
+            'avatar': SimpleUploadedFile('me.png', data, content_type='image/png'),
+        })
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.avatar.name, DEFAULT_AVATAR)
+
+        run_jobs('test')
+        self.author.refresh_from_db()
+        name = 'avatars/{}/{}.png'.format(self.author.user_id, hashlib.sha256(data).hexdigest()[:16])
+        self.assertEqual(self.author.avatar.name, name)
+        self.assertTrue(default_storage.exists(name))
+        for size in SIZES:
+            for ext, pil_format, _ in FORMATS:
+                with self.subTest(size=size, ext=ext), default_storage.open(derivative_name(name, size, ext)) as file:
+                    with Image.open(file) as image:
+                        self.assertEqual((image.format, image.size), (pil_format, (size, size)))
+
+
+class LiveAnswerTests(IsolatedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = make_author('reader')
+        self.question = Question.objects.create(title='Title', text='Text', author=self.author)
+        self.first, self.second = [
+            Answer.objects.create(question=self.question, author=self.author, text=text) for text in ('One', 'Two')
+        ]
+        self.url = reverse('answer_updates', kwargs={'pk': self.question.id})
+
+    def test_long_poll_returns_answers_after_cursor(self):
+        data = self.client.get(self.url).json()
+        self.assertEqual(data, {'events': [], 'since_id': self.second.id})
+
+        data = self.client.get(self.url, {'since_id': self.first.id}).json()
+        self.assertEqual([event['data']['id'] for event in data['events']], [self.second.id])
+        self.assertIn('Two', data['events'][0]['data']['html'])
+        self.assertEqual(data['since_id'], self.second.id)
+
+    def test_poll_reads_only_rows_active_since(self):
+        # Now() on SQLite has whole seconds, the overlap of the real poller covers that.
+        since = timezone.now() - timedelta(seconds=1)
+        Answer.objects.filter(question=self.question).update(active_at=since - timedelta(minutes=1))
+        Question.objects.filter(id=self.question.id).update(active_at=since - timedelta(minutes=1))
+        LikeAnswer.objects.vote(self.author.id, self.first.id, True)
+        third = Answer.objects.create(question=self.question, author=self.author, text='Three')
+
+        with self.assertNumQueries(2):
+            events, ratings = changes_since({self.question.id: self.second.id}, since)
+        self.assertEqual([event['id'] for _, event in events], [third.id])
+        self.assertEqual(ratings, [(self.question.id, 'answer', self.first.id, 1)])
+
+    def test_stream_sends_missed_answers_then_live_events(self):
+        messages = []
+
+        async def stream():
+            disconnect = asyncio.Event()
+
+            async def receive():
+                await disconnect.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                messages.append(message)
+                if len(messages) == 2:
+                    publish_rating(self.question.id, 'question', self.question.id, 5)
+                elif len(messages) == 3:
+                    disconnect.set()
+
+            await LiveApplication(None)({
+                'type': 'http', 'method': 'GET', 'path': self.url, 'query_string': b'',
+                'headers': [(b'accept', b'text/event-stream'), (b'last-event-id', str(self.first.id).encode())],
+            }, receive, send)
+
+        async_to_sync(stream)()
+
+        self.assertEqual(messages[0]['status'], 200)
+        self.assertIn('id: {}\nevent: answer\n'.format(self.second.id).encode(), messages[1]['body'])
+        event = messages[2]['body'].decode()
+        self.assertTrue(event.startswith('event: rating\n'))
+        self.assertEqual(json.loads(event.split('data: ')[1]),
+                         {'target': 'question', 'id': self.question.id, 'rating': 5})
+
+
+class ApiTests(IsolatedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = make_author('client')
+        self.questions = [
+            Question.objects.create(title='Question {}'.format(i), text='Text', author=self.author) for i in range(3)
+        ]
+        self.url = reverse('api_new')
+
+    def test_fields_and_cursor(self):
+        data = self.client.get(self.url, {'fields': 'title,author'}).json()
+        newest = self.questions[-1]
+        self.assertEqual(data['results'][0],
+                         {'id': newest.id, 'title': newest.title, 'author': {'id': self.author.user_id, 'name': 'client'}})
+        self.assertIsNone(data['next'])
+        self.assertEqual(self.client.get(self.url, {'fields': 'title,password'}).status_code, 400)
+
+    def test_unchanged_feed_is_not_modified(self):
+        response = self.client.get(self.url)
+        etag = response['ETag']
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(queries), 1)
+
+        LikeQuestion.objects.vote(self.author.id, self.questions[0].id, True)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class CollectedStaticTests(IsolatedTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.static_root = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, cls.static_root)
+        # Hashing and the manifest are under test; compressing every file would take most of the run.
+        cls.collected = override_settings(STATIC_ROOT=cls.static_root, WHITENOISE_SKIP_COMPRESS_EXTENSIONS=[
+            'css', 'js', 'map', 'svg', 'eot', 'ttf', 'otf', 'woff', 'woff2', 'jpg', 'png',
+        ])
+        cls.collected.enable()
+        cls.addClassCleanup(cls.collected.disable)
+        call_command('collectstatic', interactive=False, verbosity=0)
+
+    def test_pages_render_with_manifest(self):
+        for name in ('login', 'signup', 'new'):
+            with self.subTest(name):
+                response = self.client.get(reverse(name))
+                self.assertEqual(response.status_code, 200)
+                self.assertContains(response, '/static/dist/app.')
+
+    @override_settings(DEBUG=True)
+    def test_one_stylesheet_and_one_script_per_page(self):
+        response = self.client.get(reverse('new'))
+        self.assertContains(response, '<link href="/static/', count=1)
+        self.assertContains(response, '<link href="/static/dist/app.', count=1)
+        self.assertContains(response, '<script', count=1)
+        self.assertContains(response, '<script src="/static/dist/app.', count=1)
+
+
+class MetricsEndpointTests(IsolatedTestCase):
+    def test_requires_token(self):
+        url = reverse('metrics')
+        with override_settings(METRICS_TOKEN=''):
+            self.assertEqual(self.client.get(url, REMOTE_ADDR='127.0.0.1').status_code, 404)
+        with override_settings(METRICS_TOKEN='secret'):
+            self.assertEqual(self.client.get(url, REMOTE_ADDR='127.0.0.1').status_code, 404)
+            self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer wrong').status_code, 404)
+            response = self.client.get(url, HTTP_AUTHORIZATION='Bearer secret')
+            self.assertEqual(response.status_code, 200)
+            self.assertContains(response, '# TYPE')
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_requests_leave_the_file_to_the_flusher(self):
+        def served():
+            text = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret').content.decode()
+            match = re.search(r'^askme_requests_total{view="new"} (\S+)$', text, re.MULTILINE)
+            return float(match[1]) if match else 0
+
+        before = served()
+        with mock.patch('app.metrics.sqlite3.connect') as connect:
+            self.client.get(reverse('new'))
+        connect.assert_not_called()
+        self.assertEqual(served(), before + 1)
+
+
+class ReplicaRoutingTests(IsolatedTransactionTestCase):
+    # Outside the transaction of a TestCase, where every read stays on the primary.
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        super().setUp()
+        self.author = make_author('router')
+        self.question = Question.objects.create(title='Title', text='Text', author=self.author)
+        health = mock.patch('app.routers.replica_health', ReplicaHealth())
+        health.start()
+        self.addCleanup(health.stop)
+
+    def queries(self, method, url, data=None):
+        """The response and the statements sent to the primary and the replica while serving it."""
+        with CaptureQueriesContext(connections['default']) as primary:
+            with CaptureQueriesContext(connections['replica']) as replica:
+                response = getattr(self.client, method)(url, data)
+        return response, [query['sql'] for query in primary], [query['sql'] for query in replica]
+
+    def test_reads_go_to_the_replica(self):
+        response, primary, replica = self.queries('get', reverse('api_new'))
+        self.assertEqual(response.json()['results'][0]['id'], self.question.id)
+        self.assertEqual(primary, [])
+        self.assertTrue(replica)
+
+    def test_writes_go_to_the_primary_and_pin_the_following_reads(self):
+        self.client.login(username='router', password='password')
+        response, primary, replica = self.queries(
+            'post', reverse('vote_question', kwargs={'pk': self.question.id}), {'state': 'like'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(any(sql.startswith('INSERT INTO "app_likequestion"') for sql in primary))
+        self.assertEqual(replica, [])
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+        _, primary, replica = self.queries('get', reverse('api_new'))
+        self.assertTrue(primary)
+        self.assertEqual(replica, [])
+
+    def test_unhealthy_replica_falls_back_to_the_primary(self):
+        with mock.patch.object(connections['replica'], 'is_usable', return_value=False):
+            _, primary, replica = self.queries('get', reverse('api_new'))
+        self.assertTrue(primary)
+        self.assertEqual(replica, [])
+
+
+class VoteStressTests(IsolatedTransactionTestCase):
+    threads = 8
+    votes_per_thread = 50
+
+    def test_concurrent_votes_on_hot_question(self):
+        authors = [make_author('voter{}'.format(i)) for i in range(self.threads)]
+        question = Question.objects.create(title='Hot', text='Text', author=authors[0])
+        final_states = {}
+        errors = []
+
+        def hammer(author):
+            rng = random.Random(author.id)
+            state = None
+            try:
+                for _ in range(self.votes_per_thread):
+                    state, _ = LikeQuestion.objects.vote(author.id, question.id, rng.random() < 0.7)
+                final_states[author.id] = state
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=hammer, args=(author,)) for author in authors]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(errors, [])
+        expected = sum(1 if state else -1 for state in final_states.values() if state is not None)
+        question.refresh_from_db()
+        self.assertEqual(question.rating, expected)
+        self.assertEqual(LikeQuestion.objects.filter(question=question).count(),
+                         sum(state is not None for state in final_states.values()))
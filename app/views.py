@@ -1,14 +1,33 @@
+import hmac
+from functools import partial, wraps
+
 from django.contrib.auth.decorators import login_required
-from django.shortcuts import render, redirect, reverse, get_object_or_404
-from app.models import Question, Answer, Author
+from django.shortcuts import render, redirect, reverse
+from app.models import Question, Answer, Author, Tag, TagFeed, LikeQuestion, LikeAnswer
 from app.forms import LoginForm, RegisterForm, SettingsForm, AnswerForm, AskQuestion
+from app.pagination import CursorPaginator, InvalidCursor, estimate_count
+from app import search as question_search
+from app import cache
+from app import live
+from app.cache import cache_anonymous_page, invalidate_user, purge_pages
+from app.concurrency import gather_sync, run_sync
+from app.metrics import prometheus_text
 from django.contrib import auth
 from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+from django.conf import settings
+from django.http import Http404, HttpResponse, JsonResponse
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from django.views.decorators.http import require_POST
 
 
-def pagination(object_list, request, per_page=10):
+def pagination(object_list, request, per_page=10, count=None):
     p = request.GET.get('page')
     paginator = Paginator(object_list, per_page)
+    if count is not None:
+        # A denormalized count saves the COUNT(*) query.
+        paginator.count = count
+    if p == 'last':
+        p = paginator.num_pages
 
     try:
         content = paginator.page(p)
@@ -20,32 +39,79 @@ def pagination(object_list, request, per_page=10):
     return content
 
 
-def new_questions(request):
-    return render(request, "hot_questions.html", {
-        'questions': pagination(Question.objects.new().prefetch_related('likequestion_set'), request),
+def cursor_pagination(object_list, request, per_page=10, estimate=None):
+    paginator = CursorPaginator(object_list, per_page, estimate=estimate)
+
+    try:
+        content = paginator.page(after=request.GET.get('after'), before=request.GET.get('before'))
+    except InvalidCursor:
+        content = paginator.page()
+
+    return content
+
+
+async def question_feed(request, questions, feed_type):
+    """The feed page and the right column fetched concurrently, then rendered off the event loop."""
+    page, popular_tags, popular_members = await gather_sync(
+        partial(cursor_pagination, questions.select_related('author'), request,
+                estimate=lambda: estimate_count(Question)),
+        cache.popular_tags,
+        cache.popular_members,
+    )
+    return await run_sync(render, request, "hot_questions.html", {
+        'questions': page,
         'style': True,
-        'type': 'new'
+        'type': feed_type,
+        'popular_tags': popular_tags,
+        'popular_members': popular_members
     })
 
 
-def hot_questions(request):
+@cache_anonymous_page
+async def new_questions(request):
+    return await question_feed(request, Question.objects.new(), 'new')
+
+
+@cache_anonymous_page
+async def hot_questions(request):
+    return await question_feed(request, Question.objects.hot(), 'hot')
+
+
+@cache_anonymous_page
+def tag_questions(request, tag):
+    tag_id, count = Tag.objects.filter(tag=tag).values_list('id', 'count').first() or (None, 0)
+    sort = 'hot' if request.GET.get('sort') == 'hot' else 'new'
+    feed = TagFeed.objects.hot(tag_id) if sort == 'hot' else TagFeed.objects.new(tag_id)
+
+    questions = cursor_pagination(feed.values('id', 'date', 'rating', 'question_id'), request, estimate=lambda: count)
+    loaded = Question.objects.select_related('author').in_bulk([row['question_id'] for row in questions])
+    questions.object_list = [loaded[row['question_id']] for row in questions if row['question_id'] in loaded]
+
     return render(request, "hot_questions.html", {
-        'questions': pagination(Question.objects.hot().prefetch_related('likequestion_set'), request),
+        'questions': questions,
         'style': True,
-        'type': 'hot'
+        'tag': tag,
+        'sort': sort
     })
 
 
-def tag_questions(request, tag):
+def author_questions(request, author):
     return render(request, "hot_questions.html", {
-        'questions': pagination(Question.objects.tag(tag), request),
+        'questions': cursor_pagination(Question.objects.author(author).select_related('author'), request),
         'style': True
     })
 
 
-def author_questions(request, author):
-    return render(request, "hot_questions.html", {
-        'questions': pagination(Question.objects.author(author).prefetch_related('likequestion_set'), request),
+def search(request):
+    query = request.GET.get('q', '').strip()
+    try:
+        questions = question_search.search(query, after=request.GET.get('after'), before=request.GET.get('before'))
+    except InvalidCursor:
+        questions = question_search.search(query)
+
+    return render(request, "search.html", {
+        'questions': questions,
+        'query': query,
         'style': True
     })
 
@@ -66,28 +132,113 @@ def add_question(request):
     })
 
 
-def question_answer(request, pk):
-    last_id = Question.objects.latest('id').pk
-    if pk > last_id:
-        pk = last_id
+def find_question(pk):
+    """The question with its author; a pk past the newest question shows the newest one."""
+    question = Question.objects.detail(pk)
+    if question is None:
+        last_id = Question.objects.order_by('-id').values_list('id', flat=True).first()
+        if last_id is None or pk < last_id:
+            raise Http404('No Question matches the given query.')
+        question = Question.objects.detail(last_id)
+    return question
 
-    question = get_object_or_404(Question, id=pk)
-    if request.method == 'POST':
-        form = AnswerForm(data=request.POST, author=request.user.author, question=question)
-        if form.is_valid():
-            form.save()
-            return redirect(reverse('question', kwargs={'pk': pk}) + '?page=last')
 
-    else:
-        form = AnswerForm(None, None)
-    return render(request, "question_answer.html", {
-        'questions': Question.objects.one_question(pk),
+def question_page(request, pk):
+    question = find_question(pk)
+    return question, pagination(Answer.objects.page(question.id), request, per_page=3, count=question.answers_count)
+
+
+def post_answer(request, pk):
+    question = find_question(pk)
+    form = AnswerForm(data=request.POST, author=request.user.author, question=question)
+    if form.is_valid():
+        form.save()
+        return form, reverse('question', kwargs={'pk': question.id}) + '?page=last'
+    return form, None
+
+
+@cache_anonymous_page
+async def question_answer(request, pk):
+    form = AnswerForm(None, None)
+    if request.method == 'POST':
+        form, next_url = await run_sync(post_answer, request, pk)
+        if next_url is not None:
+            return redirect(next_url)
+
+    (question, comments), popular_tags, popular_members = await gather_sync(
+        partial(question_page, request, pk),
+        cache.popular_tags,
+        cache.popular_members,
+    )
+    return await run_sync(render, request, "question_answer.html", {
+        'question': question,
+        'questions': [question],
         'style': False,
-        'comments': pagination(Answer.objects.answers(pk), request, per_page=3),
-        'form': form
+        'comments': comments,
+        'form': form,
+        'popular_tags': popular_tags,
+        'popular_members': popular_members
     })
 
 
+async def answer_updates(request, pk):
+    """
+    Long-polling fallback of the answer stream that app.live serves on the same URL:
+    new answers and ratings after ?since_id=, the cursor to send next time as since_id.
+    """
+    updates = await live.long_poll(pk, live.parse_since_id(request.GET.get('since_id')))
+    if updates is None:
+        raise Http404('No Question matches the given query.')
+    events, since_id = updates
+    return JsonResponse({
+        'events': [{'event': event['event'], 'data': event['data']} for event in events],
+        'since_id': since_id
+    })
+
+
+def login_before_csrf(view):
+    """
+    401 for logged-out visitors before the CSRF check, which they always fail: pages only carry
+    a CSRF token for logged-in users. The client needs the 401 to send them to the login page.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'error': 'login required'}, status=401)
+        return csrf_protect(view)(request, *args, **kwargs)
+
+    return csrf_exempt(wrapper)
+
+
+def vote(request, reactions, question_ids, pk):
+    state = request.POST.get('state')
+    if state not in ('like', 'dislike'):
+        return JsonResponse({'error': 'state must be like or dislike'}, status=400)
+    question_id = question_ids.first()
+    if question_id is None:
+        return JsonResponse({'error': 'not found'}, status=404)
+
+    current, rating = reactions.vote(request.user.author.id, pk, state == 'like')
+    purge_pages(reverse('question', kwargs={'pk': question_id}))
+    live.publish_rating(question_id, reactions.target, pk, rating)
+    return JsonResponse({
+        'rating': rating,
+        'state': None if current is None else ('like' if current else 'dislike')
+    })
+
+
+@require_POST
+@login_before_csrf
+def vote_question(request, pk):
+    return vote(request, LikeQuestion.objects, Question.objects.filter(id=pk).values_list('id', flat=True), pk)
+
+
+@require_POST
+@login_before_csrf
+def vote_answer(request, pk):
+    return vote(request, LikeAnswer.objects, Answer.objects.filter(id=pk).values_list('question_id', flat=True), pk)
+
+
 @login_required
 def settings_page(request):
     if request.method == 'POST':
@@ -128,6 +279,8 @@ def login_page(request):
 
 
 def logout(request):
+    if request.user.is_authenticated:
+        invalidate_user(request.user.id)
     auth.logout(request)
     return redirect(request.GET.get('next', '/'))
 
@@ -151,3 +304,10 @@ def signup_page(request):
                 auth.login(request, user)
                 return redirect(next_page)
     return render(request, "signup_page.html", { 'form': form })
+
+
+def metrics(request):
+    token = request.META.get('HTTP_AUTHORIZATION', '')
+    if not settings.METRICS_TOKEN or not hmac.compare_digest(token, 'Bearer ' + settings.METRICS_TOKEN):
+        raise Http404
+    return HttpResponse(prometheus_text(), content_type='text/plain; version=0.0.4')
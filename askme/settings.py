@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.1/ref/settings/
 """
 
+import os
+import sys
 from pathlib import Path
 import dj_database_url
 
@@ -37,28 +39,31 @@ INSTALLED_APPS = [
     'django.contrib.contenttypes',
     'django.contrib.sessions',
     'django.contrib.messages',
+    # Before staticfiles, so its collectstatic (which builds the bundles) takes precedence.
+    'app',
     'django.contrib.staticfiles',
     'bootstrap_pagination',
-    'app',
     'bootstrap4'
 ]
 
 MIDDLEWARE = [
+    'app.metrics.metrics_middleware',
     'django.middleware.security.SecurityMiddleware',
+    'app.storage.StaticFilesMiddleware',
+    'app.routers.primary_pin_middleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'app.auth.CachedAuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
 ]
 
 ROOT_URLCONF = 'askme.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'app.metrics.InstrumentedDjangoTemplates',
         'DIRS': ['templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -83,12 +88,94 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': str(BASE_DIR / 'db.sqlite3'),
+        # A file instead of shared in-memory SQLite, so threaded tests wait on locks instead of failing
+        'TEST': {
+            'NAME': str(BASE_DIR / 'test_db.sqlite3'),
+        },
     }
 
 }
-# DATABASES = {
-#     'default': dj_database_url.config(conn_max_age=600, ssl_require=True)
-# }
+if os.environ.get('DATABASE_URL'):
+    DATABASES['default'] = dj_database_url.config(conn_max_age=600, ssl_require=True)
+
+# Feed, question and search reads go to the replica when there is one, see app/routers.py.
+# Locally: REPLICA_DATABASE_URL=sqlite:///replica.sqlite3, filled by manage.py sync_sqlite_replica
+if os.environ.get('REPLICA_DATABASE_URL'):
+    DATABASES['replica'] = dj_database_url.parse(os.environ['REPLICA_DATABASE_URL'], conn_max_age=600)
+    DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+elif sys.argv[1:2] == ['test']:
+    # The router tests need a second alias; under test it is a connection to the test database.
+    DATABASES['replica'] = {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}}
+
+DATABASE_ROUTERS = ['app.routers.ReplicaRouter']
+# Upper bound of the replication lag: how long reads stay on the primary after a write
+REPLICA_PIN_SECONDS = 5
+REPLICA_HEALTH_CHECK_INTERVAL = 30
+
+# Cache shared by all gunicorn workers on the host: the right column, question cards, anonymous
+# pages and their generations, sessions and user snapshots. In production a memcached with
+# memory for all of them (memcached -m), e.g. MEMCACHED_LOCATION=127.0.0.1:11211. The file cache
+# is for development only: every set() lists the directory to cull, slow at tens of thousands
+# of entries, and past MAX_ENTRIES it drops a random CULL_FREQUENCY-th of everything.
+# https://docs.djangoproject.com/en/3.1/topics/cache/
+
+if os.environ.get('MEMCACHED_LOCATION'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': os.environ['MEMCACHED_LOCATION'].split(','),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': str(BASE_DIR / 'cache'),
+            'OPTIONS': {
+                'MAX_ENTRIES': 20000,
+                'CULL_FREQUENCY': 10,
+            },
+        }
+    }
+
+# Sessions are read from the cache and written through to the database, so a cleared
+# cache logs nobody out.
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+# request.user and its author, see app/auth.py
+USER_CACHE_TIMEOUT = 300
+
+RIGHT_COLUMN_CACHE_TIMEOUT = 300
+QUESTION_CARD_CACHE_TIMEOUT = 24 * 60 * 60
+PAGE_CACHE_TIMEOUT = 60
+
+# Background jobs, see app/jobs.py. Each web process drains the queue in a thread woken
+# on commit; `manage.py run_jobs` does the same as a separate process.
+JOBS_IN_PROCESS = True
+JOBS_BATCH_SIZE = 100
+JOBS_POLL_INTERVAL = 5
+JOBS_LEASE_SECONDS = 300
+JOBS_MAX_ATTEMPTS = 5
+JOBS_RETRY_DELAY = 10
+
+# Live answers on question pages, see app/live.py. Streams also poll the database every
+# LIVE_POLL_INTERVAL seconds for what other worker processes wrote; 0 with a single worker.
+LIVE_POLL_INTERVAL = 2
+# Longest expected commit delay; each poll rereads the rows active this long before the previous one.
+LIVE_POLL_OVERLAP = 5
+LIVE_HEARTBEAT_INTERVAL = 15
+LIVE_LONG_POLL_TIMEOUT = 25
+LIVE_RETRY_MS = 3000
+LIVE_QUEUE_SIZE = 100
+LIVE_BATCH_SIZE = 50
+
+# Per-view metrics, summed across workers in a local SQLite file and served at /metrics to
+# scrapers sending "Authorization: Bearer $METRICS_TOKEN"; without a token, to nobody.
+# Behind the proxy every client has REMOTE_ADDR 127.0.0.1, so the address proves nothing.
+METRICS_DB = BASE_DIR / 'metrics.sqlite3'
+# Seconds between the flushes of each worker's background thread; with 0 there is no thread
+# and a worker's numbers only reach the file when /metrics is scraped from it.
+METRICS_FLUSH_INTERVAL = 5
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
 
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
@@ -126,12 +213,31 @@ USE_TZ = True
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/3.1/howto/static-files/
 
-# STATIC_ROOT = BASE_DIR / 'static/'
+STATIC_ROOT = BASE_DIR / 'staticfiles'
 STATIC_URL = '/static/'
 STATICFILES_DIRS = [
     BASE_DIR / "static",
-    '/var/www/static/',
 ]
+STATICFILES_STORAGE = 'app.storage.StaticStorage'
+
+# Concatenated and minified by collectstatic into static/<bundle>, see app/assets.py. Pages link
+# the bundle once it is collected, in DEBUG too, so run collectstatic again after editing a source.
+STATIC_BUNDLES = {
+    'dist/app.css': [
+        'css/add-question.css',
+        'css/style-206.css',
+        'font-awesome-4.7.0/css/font-awesome.min.css',
+        'css/base.css',
+        'css/bootstrap.min.css',
+    ],
+    'dist/app.js': [
+        'js/jquery-3.5.1.min.js',
+        'js/popper.min.js',
+        'js/bootstrap.min.js',
+        'js/vote.js',
+        'js/live.js',
+    ],
+}
 
 MEDIA_ROOT = BASE_DIR / 'uploads/'
 MEDIA_URL = '/uploads/'
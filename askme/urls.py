@@ -17,19 +17,30 @@ from django.contrib import admin
 from django.urls import path
 from django.conf import settings
 from django.conf.urls.static import static
-from app import views
+from app import api, views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('api/questions/', api.new_questions, name='api_new'),
+    path('api/questions/hot/', api.hot_questions, name='api_hot'),
+    path('api/questions/<int:pk>/', api.question_detail, name='api_question'),
+    path('api/questions/<int:pk>/answers/', api.question_answers, name='api_answers'),
+    path('api/tag/<tag>/', api.tag_questions, name='api_tag'),
+    path('api/author/<int:author>/', api.author_questions, name='api_author'),
     path('hot/', views.hot_questions, name='hot'),
     path('tag/<tag>', views.tag_questions, name='tag'),
     path('login/', views.login_page, name='login'),
     path('signup/', views.signup_page, name='signup'),
     path('settings/', views.settings_page, name='settings'),
     path('question/<int:pk>/', views.question_answer, name='question'),
+    path('question/<int:pk>/live/', views.answer_updates, name='answer_updates'),
+    path('question/<int:pk>/vote/', views.vote_question, name='vote_question'),
+    path('answer/<int:pk>/vote/', views.vote_answer, name='vote_answer'),
     path('author/<int:author>/', views.author_questions, name='author'),
     path('ask/', views.add_question, name='ask'),
+    path('search/', views.search, name='search'),
     path('logout/', views.logout, name='logout'),
+    path('metrics', views.metrics, name='metrics'),
     path('', views.new_questions, name='new'),
 ]
 
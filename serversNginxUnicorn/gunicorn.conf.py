@@ -2,3 +2,5 @@ import multiprocessing
 
 bind = "127.0.0.1:8081"
 workers = multiprocessing.cpu_count() * 2 + 1
+# askme.asgi:application; the feed and question views are async
+worker_class = "uvicorn.workers.UvicornWorker"
@@ -0,0 +1,53 @@
+(function () {
+    var answers = $('.js-answers');
+    if (!answers.length) {
+        return;
+    }
+    var url = answers.data('url');
+    var sinceId = null;
+
+    function handle(name, data) {
+        if (name === 'answer') {
+            if (!$('.js-rating[data-answer-id="' + data.id + '"]').length) {
+                answers.append(data.html);
+            }
+        } else if (name === 'rating') {
+            $('.js-rating[data-' + data.target + '-id="' + data.id + '"]').find('.js-rating-value').text(data.rating);
+        }
+    }
+
+    function poll() {
+        $.getJSON(url, sinceId === null ? {} : {since_id: sinceId}).done(function (data) {
+            $.each(data.events, function (i, event) {
+                handle(event.event, event.data);
+            });
+            sinceId = data.since_id;
+            poll();
+        }).fail(function () {
+            setTimeout(poll, 5000);
+        });
+    }
+
+    if (!window.EventSource) {
+        poll();
+        return;
+    }
+
+    var opened = false;
+    var source = new EventSource(url);
+    source.onopen = function () {
+        opened = true;
+    };
+    $.each(['answer', 'rating'], function (i, name) {
+        source.addEventListener(name, function (event) {
+            handle(name, JSON.parse(event.data));
+        });
+    });
+    source.onerror = function () {
+        // Once the stream was up the browser reconnects by itself, sending Last-Event-ID.
+        if (!opened) {
+            source.close();
+            poll();
+        }
+    };
+})();
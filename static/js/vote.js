@@ -0,0 +1,17 @@
+$(document).on('click', '.js-vote', function (event) {
+    event.preventDefault();
+    var link = $(this);
+
+    $.ajax({
+        url: link.data('url'),
+        method: 'POST',
+        data: {state: link.data('state')},
+        headers: {'X-CSRFToken': $('meta[name="csrf-token"]').attr('content')}
+    }).done(function (data) {
+        link.closest('.js-rating').find('.js-rating-value').text(data.rating);
+    }).fail(function (xhr) {
+        if (xhr.status === 401) {
+            window.location = '/login/?next=' + encodeURIComponent(window.location.pathname);
+        }
+    });
+});